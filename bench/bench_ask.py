@@ -0,0 +1,71 @@
+# Сравнение последовательной и параллельной отправки запросов к DeepSeek
+# на локальном имитаторе сервера chat completions.
+#
+#   pipenv run python bench/bench_ask.py --requests 40 --latency 0.5 --workers 8
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib.jira_deepseek import JiraDeepSeek
+
+
+def make_handler(latency):
+    class CompletionHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(latency)
+
+            content = json.dumps({'message': 'Привет! Как дела с задачей?', 'recipients': ['john.doe']})
+            body = json.dumps({'choices': [{'message': {'content': content}}]}).encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return CompletionHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DeepSeek dispatch benchmark")
+    parser.add_argument('--requests', help='Number of requests', default=40, type=int)
+    parser.add_argument('--latency',  help='Mock completion latency, seconds', default=0.5, type=float)
+    parser.add_argument('--workers',  help='Concurrent workers', default=8, type=int)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(args.latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    ds = JiraDeepSeek(token='bench', url='http://127.0.0.1:{}/chat/completions'.format(server.server_port),
+                      prompts={'default': 'system'})
+    tasks = [(json.dumps({'title': 'Issue {}'.format(i)}), '') for i in range(args.requests)]
+
+    started = time.perf_counter()
+    serial = [ds.ask(prompt, system_prompt) for prompt, system_prompt in tasks]
+    serial_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    concurrent = list(ds.ask_many(tasks, workers=args.workers))
+    concurrent_time = time.perf_counter() - started
+
+    server.shutdown()
+
+    assert serial == concurrent
+
+    print('serial:     {:.2f}s'.format(serial_time))
+    print('concurrent: {:.2f}s ({} workers)'.format(concurrent_time, args.workers))
+    print('speedup:    {:.1f}x'.format(serial_time / concurrent_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# Сквозной замер main.py на локальных имитаторах Jira и DeepSeek.
+# Отчёт: время выполнения, пропускная способность, p50/p95 по этапам, количество запросов
+# и пиковое потребление памяти. С --baseline сравнивает результат с сохранённым отчётом
+# и завершается с ошибкой при ухудшении, что позволяет запускать замер в CI.
+#
+#   pipenv run python bench/bench_pipeline.py --issues 300 --histories 500 --output report.json
+#   pipenv run python bench/bench_pipeline.py --baseline report.json --tolerance 0.2
+import argparse
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_servers import MockJira, MockDeepSeek
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+STAGE_LINE = re.compile(r'Stage (?P<name>\S+): (?P<count>\d+) calls, (?P<total>[\d.]+)s total, (?P<avg>[\d.]+)s avg, '
+                        r'(?P<p50>[\d.]+)s p50, (?P<p95>[\d.]+)s p95')
+
+
+def run_pipeline(args, jira, deepseek, workdir):
+    query_file = os.path.join(workdir, 'query.yml')
+    with open(query_file, 'w') as stream:
+        stream.write('queries:\n  default: project = {project}\nrules: {{}}\n'.format(project=jira.project))
+
+    command = [sys.executable, os.path.join(ROOT, 'main.py'),
+               '-ju', jira.url, '-jt', 'bench', '-dt', 'bench', '-du', deepseek.url + 'chat/completions',
+               '--jira_query_file', query_file,
+               '--prompts_file', os.path.join(ROOT, 'prompts.yml'),
+               '--fields_cache', os.path.join(workdir, 'fields.json'),
+               '--comments_log', os.path.join(workdir, 'comments.log'),
+               '--max_jira_results', str(args.issues),
+               '--mode', 'comment', '--score_limit', '0'] + args.main_args
+
+    started = time.perf_counter()
+    process = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+
+    return process, elapsed
+
+
+def make_report(args, process, elapsed, jira, deepseek):
+    stages = {}
+    for match in STAGE_LINE.finditer(process.stderr):
+        stages[match.group('name')] = {k: float(match.group(k)) for k in ['count', 'total', 'avg', 'p50', 'p95']}
+
+    return {
+        'returncode': process.returncode,
+        'issues': args.issues,
+        'wall_seconds': round(elapsed, 3),
+        'issues_per_second': round(args.issues / elapsed, 2),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        'jira_requests': dict(jira.requests),
+        'jira_requests_total': sum(v for k, v in jira.requests.items() if k != 'error'),
+        'jira_bytes_sent': jira.bytes_sent,
+        'deepseek_requests': deepseek.requests['completion'],
+        'comments_posted': sum(len(v) for v in jira.posted.values()),
+        'stages': stages
+    }
+
+
+# Сравнение с базовым отчётом: время, количество запросов и память не должны вырасти больше допуска
+def compare(report, baseline, tolerance):
+    regressions = []
+
+    for key in ['wall_seconds', 'jira_requests_total', 'deepseek_requests', 'peak_rss_mb']:
+        if key in baseline and report[key] > baseline[key] * (1 + tolerance):
+            regressions.append('{key}: {value} > {base} (+{tol:.0%})'.format(
+                key=key, value=report[key], base=baseline[key], tol=tolerance))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--issues',           help='Synthetic issues', default=300, type=int)
+    parser.add_argument('--histories',        help='Changelog entries per issue', default=200, type=int)
+    parser.add_argument('--comments',         help='Comments per issue', default=20, type=int)
+    parser.add_argument('--links',            help='Links per issue', default=3, type=int)
+    parser.add_argument('--jira_latency',     help='Mock Jira latency, seconds', default=0.05, type=float)
+    parser.add_argument('--deepseek_latency', help='Mock DeepSeek latency, seconds', default=0.5, type=float)
+    parser.add_argument('--error_rate',       help='Share of 503 responses', default=0.0, type=float)
+    parser.add_argument('--output',           help='Write report to a json file')
+    parser.add_argument('--baseline',         help='Baseline report to compare with')
+    parser.add_argument('--tolerance',        help='Allowed regression against baseline', default=0.2, type=float)
+    parser.add_argument('main_args',          help='Extra main.py arguments (after --)', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    if args.main_args[:1] == ['--']:
+        args.main_args = args.main_args[1:]
+
+    jira = MockJira(issues=args.issues, histories=args.histories, comments=args.comments, links=args.links,
+                    latency=args.jira_latency, error_rate=args.error_rate).start()
+    deepseek = MockDeepSeek(latency=args.deepseek_latency, error_rate=args.error_rate).start()
+
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            process, elapsed = run_pipeline(args, jira, deepseek, workdir)
+    finally:
+        jira.stop()
+        deepseek.stop()
+
+    report = make_report(args, process, elapsed, jira, deepseek)
+    print(json.dumps(report, indent=2))
+
+    if process.returncode:
+        sys.stderr.write(process.stderr[-5000:])
+        sys.exit(process.returncode)
+
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(report, stream, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as stream:
+            regressions = compare(report, json.load(stream), args.tolerance)
+
+        if regressions:
+            print('Regressions:\n  ' + '\n  '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# Сравнение разбора правил на каждой задаче с предварительно разобранными правилами
+# на синтетических задачах.
+#
+#   pipenv run python bench/bench_rules.py --issues 5000
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib.issue_record import IssueRecord
+from lib.rules import Rules
+
+
+# Разбор условий на каждой задаче, как это делалось до предварительной компиляции
+def interpreted_actions(item, rules):
+    actions = []
+
+    for rule_name in rules:
+        conditions = rules[rule_name]['conditions']
+        if type(conditions) != list:
+            conditions = [conditions]
+
+        for condition in conditions:
+            key, operator, value = re.split(r'(<=|>=|!=|<|>|=)', condition, maxsplit=1)
+            ptr = item
+
+            for key_part in key.split('.'):
+                if hasattr(ptr, key_part):
+                    ptr = getattr(ptr, key_part)
+                elif type(ptr) == dict and key_part in ptr:
+                    ptr = ptr[key_part]
+                else:
+                    raise Exception("Failed to get property {name}".format(name=key_part))
+
+            if not Rules().compare(ptr, value, operator):
+                break
+        else:
+            actions.append(rule_name)
+
+    return actions
+
+
+def make_issue(i):
+    rnd = random.Random(i)
+
+    return IssueRecord(
+        key='BENCH-{}'.format(i),
+        fields={'status': {'name': rnd.choice(['Open', 'Linked', 'In Progress'])}},
+        stats_linked={'total': 3, 'closed': 1, 'closed_perc': rnd.choice([0, 33.0, 100.0])},
+        data={'days_since_last_status': rnd.randint(0, 200),
+              'custom_fields': {'Product': rnd.choice(['Corp-Mail', 'Other']),
+                                'Fix Version/s': rnd.choice(['3.0', '2.0'])}}
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rules engine benchmark")
+    parser.add_argument('--issues', help='Number of synthetic issues', default=5000, type=int)
+    parser.add_argument('--rules',  help='Rules file', default=os.path.join(os.path.dirname(__file__), '..', 'jira_query_template.yml'))
+    args = parser.parse_args()
+
+    with open(args.rules) as stream:
+        rules = yaml.safe_load(stream)['rules']
+
+    issues = [make_issue(i) for i in range(args.issues)]
+
+    started = time.perf_counter()
+    interpreted = [interpreted_actions(issue, rules) for issue in issues]
+    interpreted_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    compiled = Rules(rules).get_actions_many(issues)
+    compiled_time = time.perf_counter() - started
+
+    assert interpreted == compiled
+
+    print('interpreted: {:.3f}s'.format(interpreted_time))
+    print('compiled:    {:.3f}s'.format(compiled_time))
+    print('speedup:     {:.1f}x'.format(interpreted_time / compiled_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+# Локальные имитаторы Jira REST API и DeepSeek chat completions для замеров производительности.
+# Задержка ответа и доля ошибок 503 настраиваются, задачи генерируются детерминированно
+# с заданным количеством записей журнала изменений и комментариев
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class MockServer:
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = defaultdict(int)
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.make_handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{port}/'.format(port=self.server.server_port)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, name):
+        with self.lock:
+            self.requests[name] += 1
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def handle_request(self, method):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length)) if length else None
+
+                time.sleep(server.latency)
+
+                if server.should_fail():
+                    server.count('error')
+                    return self.reply(503, {'errorMessages': ['Service unavailable']})
+
+                status, payload = server.route(method, parsed.path, parse_qs(parsed.query), body)
+                self.reply(status, payload)
+
+            def reply(self, status, payload):
+                data = json.dumps(payload).encode()
+
+                with server.lock:
+                    server.bytes_sent += len(data)
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def route(self, method, path, query, body):
+        raise NotImplementedError
+
+
+class MockJira(MockServer):
+    statuses = ['New', 'Open', 'In Progress', 'Waiting QA']
+    priorities = ['Blocker', 'Critical', 'Major', 'Minor']
+
+    def __init__(self, issues=300, histories=200, comments=20, links=3, project='BENCH', **kwargs):
+        super().__init__(**kwargs)
+        self.project = project
+        self.now = datetime.now(timezone.utc)
+        self.issues = {}
+        self.keys = ['{project}-{n}'.format(project=project, n=n) for n in range(1, issues + 1)]
+
+        for n, key in enumerate(self.keys):
+            self.issues[key] = self.make_issue(n, key, histories, comments, links)
+
+        self.posted = defaultdict(list)
+
+    def timestamp(self, days_ago):
+        return (self.now - timedelta(days=days_ago)).strftime('%Y-%m-%dT%H:%M:%S.000+0000')
+
+    def user(self, n):
+        return {'name': 'user{n}'.format(n=n), 'displayName': 'User {n}'.format(n=n)}
+
+    def make_issue(self, n, key, histories, comments, links):
+        rnd = random.Random(n)
+        created_days = rnd.randint(30, 300)
+
+        changelog = []
+        status = 'New'
+        for h in range(histories):
+            days_ago = created_days - (created_days * (h + 1)) / (histories + 1)
+            if h % 2 == 0:
+                to_status = rnd.choice(self.statuses)
+                item = {'field': 'status', 'fromString': status, 'toString': to_status}
+                status = to_status
+            else:
+                item = {'field': 'assignee', 'fromString': 'User {}'.format(rnd.randint(0, 9)),
+                        'toString': 'User {}'.format(rnd.randint(0, 9))}
+
+            changelog.append({'id': str(h), 'author': self.user(rnd.randint(0, 9)),
+                              'created': self.timestamp(days_ago), 'items': [item]})
+
+        issue_comments = [{'id': '{n}{c}'.format(n=n, c=c), 'author': self.user(rnd.randint(0, 9)),
+                           'body': 'Комментарий {c}. [~user{u}], как дела? '.format(c=c, u=rnd.randint(0, 9)) * 5,
+                           'created': self.timestamp(created_days * (comments - c) / (comments + 1))}
+                          for c in range(comments)]
+
+        issue_links = []
+        for l in range(links):
+            linked_key = '{project}-{n}'.format(project=self.project, n=rnd.randint(1, len(self.keys)))
+            issue_links.append({'id': str(l), 'type': {'name': 'Relates', 'inward': 'relates to', 'outward': 'relates to'},
+                                'outwardIssue': {'key': linked_key,
+                                                 'fields': {'status': {'name': rnd.choice(['Open', 'Closed', 'Done'])}}}})
+
+        return {
+            'id': str(10000 + n),
+            'key': key,
+            'fields': {
+                'summary': 'Synthetic issue {n}'.format(n=n),
+                'description': 'Описание задачи {n}. '.format(n=n) * 50,
+                'priority': {'name': rnd.choice(self.priorities)},
+                'assignee': self.user(rnd.randint(0, 9)) if rnd.random() > 0.1 else None,
+                'reporter': self.user(rnd.randint(0, 9)),
+                'created': self.timestamp(created_days),
+                'updated': self.timestamp(rnd.randint(0, 30)),
+                'status': {'name': status},
+                'issuelinks': issue_links,
+                'comment': {'comments': issue_comments, 'total': len(issue_comments),
+                            'maxResults': len(issue_comments), 'startAt': 0}
+            },
+            'changelog': {'startAt': 0, 'maxResults': len(changelog), 'total': len(changelog), 'histories': changelog}
+        }
+
+    # Задача с учётом запрошенных полей и раскрытий
+    def render(self, issue, fields=None, expand=''):
+        result = {'id': issue['id'], 'key': issue['key'], 'self': '{url}rest/api/2/issue/{id}'.format(url=self.url, id=issue['id'])}
+
+        if fields and '*all' not in fields:
+            result['fields'] = {name: value for name, value in issue['fields'].items() if name in fields}
+        else:
+            result['fields'] = dict(issue['fields'])
+
+        if 'changelog' in expand:
+            result['changelog'] = issue['changelog']
+
+        return result
+
+    def route(self, method, path, query, body):
+        path = path.rstrip('/')
+
+        if path.endswith('/serverInfo'):
+            self.count('serverInfo')
+            return 200, {'baseUrl': self.url, 'version': '9.4.0', 'versionNumbers': [9, 4, 0],
+                         'deploymentType': 'Server', 'buildNumber': 940000, 'serverTitle': 'Mock Jira'}
+
+        if path.endswith('/field'):
+            self.count('field')
+            return 200, [{'id': 'summary', 'name': 'Summary', 'custom': False, 'clauseNames': ['summary']},
+                         {'id': 'customfield_10001', 'name': 'Product', 'custom': True,
+                          'clauseNames': ['cf[10001]', 'Product']}]
+
+        if path.endswith('/search'):
+            self.count('search')
+            return 200, self.search(query if method == 'GET' else {k: [v] for k, v in (body or {}).items()})
+
+        match = re.search(r'/issue/([^/]+)/comment$', path)
+        if match:
+            issue = self.issues.get(match.group(1))
+            if issue is None:
+                return 404, {'errorMessages': ['Issue does not exist']}
+
+            if method == 'POST':
+                self.count('add_comment')
+                comment = {'id': str(len(self.posted[issue['key']]) + 1), 'body': body['body'],
+                           'author': self.user(0), 'created': self.timestamp(0)}
+
+                # Опубликованный комментарий виден в задаче при следующих запросах
+                with self.lock:
+                    self.posted[issue['key']].append(comment)
+                    thread = issue['fields']['comment']
+                    thread['comments'].append(comment)
+                    thread['total'] = thread['maxResults'] = len(thread['comments'])
+
+                return 201, comment
+
+            self.count('comments')
+            return 200, issue['fields']['comment']
+
+        match = re.search(r'/issue/([^/]+)$', path)
+        if match:
+            self.count('issue')
+            issue = self.issues.get(match.group(1))
+            if issue is None:
+                return 404, {'errorMessages': ['Issue does not exist']}
+
+            return 200, self.render(issue, expand=query.get('expand', [''])[0])
+
+        self.count('unknown')
+        return 404, {'errorMessages': ['Unknown path {path}'.format(path=path)]}
+
+    def search(self, query):
+        def param(name, default):
+            value = query.get(name, [default])[0]
+            return value if value is not None else default
+
+        jql = param('jql', '')
+        start_at = int(param('startAt', 0))
+        max_results = int(param('maxResults', 50))
+        # Поля приходят списком через запятую или повторяющимися параметрами fields=
+        fields = []
+        for value in query.get('fields') or ['*all']:
+            for field in value if isinstance(value, list) else str(value).split(','):
+                fields.append(field.strip())
+        expand = param('expand', '') or ''
+
+        match = re.search(r'key in \(([^)]*)\)', jql)
+        if match:
+            keys = [key.strip() for key in match.group(1).split(',') if key.strip() in self.issues]
+        else:
+            keys = self.keys
+
+        page = keys[start_at:start_at + max_results]
+
+        return {'startAt': start_at, 'maxResults': max_results, 'total': len(keys),
+                'issues': [self.render(self.issues[key], fields, expand) for key in page]}
+
+
+class MockDeepSeek(MockServer):
+    def route(self, method, path, query, body):
+        self.count('completion')
+
+        issue = json.loads(body['messages'][1]['content'])
+
+        # Пакетный запрос: ответ на каждое обращение массива
+        if isinstance(issue, list):
+            content = [dict(self.answer(entry['issue']), id=entry['id']) for entry in issue]
+        else:
+            content = self.answer(issue)
+
+        return 200, {'choices': [{'message': {'role': 'assistant', 'content': json.dumps(content, ensure_ascii=False)},
+                                  'finish_reason': 'stop'}],
+                     'usage': {'total_tokens': len(json.dumps(body)) // 3}}
+
+    def answer(self, issue):
+        recipient = issue.get('assignee') or issue.get('reporter') or 'user0'
+
+        return {'message': 'Привет, @{user}! Как продвигается задача «{title}»?'.format(user=recipient, title=issue['title']),
+                'recipients': [recipient]}
@@ -0,0 +1,84 @@
+import math
+from collections import defaultdict
+from datetime import datetime
+from dateutil import parser
+
+
+# Разбор даты Jira. Формат Jira (2024-01-31T10:15:30.000+0300) разбирается
+# встроенным fromisoformat, остальные форматы - через dateutil
+def parse_time(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parser.parse(value)
+
+
+# Анализ журнала изменений задачи за один проход: время в статусах и у исполнителей,
+# максимальные значения и время последней смены статуса
+class ChangelogAnalyzer:
+    def __init__(self, now=None):
+        self.now = now if now is not None else datetime.now().timestamp()
+
+    def days_since(self, timestamp):
+        return math.ceil((self.now - timestamp) / 86400)
+
+    def analyze(self, issue):
+        result = {
+            'log': [],
+            'summary_status': defaultdict(int),
+            'summary_assignee': defaultdict(int),
+            'last_status_time': 0,
+            'days_since_last_status': 0,
+            'max_status_time': ['None', 0],
+            'max_assignee_time': ['None', 0]
+        }
+
+        last_status_time = None
+        last_assignee_time = None
+
+        for history in issue.changelog.histories:
+            dt = None
+
+            for change in history.items:
+                if change.field != 'status' and change.field != 'assignee':
+                    continue
+
+                # Дата разбирается один раз на запись журнала и только если она нужна
+                if dt is None:
+                    dt = parse_time(history.created)
+
+                # Изменился статус
+                if change.field == 'status':
+                    result['log'].append({'ID': issue.key,
+                                          'fromString': change.fromString,
+                                          'toString': change.toString,
+                                          'created': history.created,
+                                          'author': history.author.displayName})
+
+                    if last_status_time is not None:
+                        time_spent = int((dt - last_status_time).total_seconds())
+                        self.add_time(result, 'status', change.fromString, time_spent)
+                        self.add_time(result, 'status', 'Total', time_spent)
+                        result['last_status_time'] = dt.timestamp()
+
+                    last_status_time = dt
+                # Изменился исполнитель
+                else:
+                    if last_assignee_time is not None:
+                        time_spent = int((dt - last_assignee_time).total_seconds())
+                        self.add_time(result, 'assignee', change.fromString, time_spent)
+
+                    last_assignee_time = dt
+
+        if result['last_status_time']:
+            result['days_since_last_status'] = self.days_since(result['last_status_time'])
+
+        return result
+
+    # Накопление времени с одновременным обновлением максимума
+    def add_time(self, result, kind, name, time_spent):
+        summary = result['summary_' + kind]
+        summary[name] += time_spent
+
+        if summary[name] > result['max_' + kind + '_time'][1]:
+            result['max_' + kind + '_time'] = [name, summary[name]]
@@ -0,0 +1,102 @@
+import logging as log
+import os
+import queue
+import threading
+
+
+# Публикация комментариев отдельным этапом: запросы к DeepSeek не ждут записи в Jira.
+# Очередь ограничена, при её заполнении подготовка комментариев ждёт освобождения места.
+# Скорость записи ограничивается общим планировщиком запросов к Jira.
+# Каждый комментарий содержит скрытую метку задачи и запуска, комментарий с меткой,
+# которая уже есть в задаче, повторно не публикуется
+class CommentPoster:
+    def __init__(self, jira_tools, run_id, workers=2, queue_size=20, log_path=None, on_posted=None):
+        self.jira_tools = jira_tools
+        self.run_id = run_id
+        self.on_posted = on_posted
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.stats = {'posted': 0, 'duplicate': 0, 'failed': 0}
+        self.lock = threading.Lock()
+
+        # Журнал дописывается целыми записями и сбрасывается на диск после каждой из них
+        self.log_file = open(log_path, 'a') if log_path else None
+
+        self.threads = [threading.Thread(target=self.worker, daemon=True) for i in range(max(1, workers))]
+
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, issue, text):
+        self.queue.put((issue, text))
+
+    def worker(self):
+        while True:
+            task = self.queue.get()
+
+            if task is None:
+                break
+
+            try:
+                self.post(*task)
+            except Exception as exc:
+                log.error('Failed to comment {id}: {error}'.format(id=task[0]['id'], error=exc))
+                self.count('failed')
+
+    # Метка найдена среди комментариев, полученных при сборе данных
+    def is_duplicate(self, issue):
+        marker = self.jira_tools.comment_marker(issue['id'], self.run_id)
+
+        return marker in issue['source'].data.get('comment_markers', [])
+
+    # Пропуск задачи, которая уже содержит комментарий с меткой запуска
+    def skip_duplicate(self, issue):
+        log.info('Issue {id} already has a comment from run {run}'.format(id=issue['id'], run=self.run_id))
+        self.count('duplicate')
+
+    def post(self, issue, text):
+        marker = self.jira_tools.comment_marker(issue['id'], self.run_id)
+
+        if self.is_duplicate(issue):
+            self.skip_duplicate(issue)
+            return
+
+        with self.jira_tools.metrics.stage('post_comment'):
+            comment = self.jira_tools.add_comment(issue, text + '\n' + marker, marker=marker)
+
+        if not comment:
+            self.count('failed')
+            return
+
+        self.count('posted')
+        self.write_log(issue, text)
+
+        if self.on_posted:
+            self.on_posted(issue, comment)
+
+    def count(self, status):
+        with self.lock:
+            self.stats[status] += 1
+
+        self.jira_tools.metrics.inc('comments', status=status)
+
+    def write_log(self, issue, text):
+        if not self.log_file:
+            return
+
+        with self.lock:
+            self.log_file.write(text + "\n" + issue['url'] + "\n\n\n")
+            self.log_file.flush()
+            os.fsync(self.log_file.fileno())
+
+    # Ожидание публикации всех комментариев из очереди
+    def close(self):
+        for thread in self.threads:
+            self.queue.put(None)
+
+        for thread in self.threads:
+            thread.join()
+
+        if self.log_file:
+            self.log_file.close()
+
+        log.info('Comments: {posted} posted, {duplicate} duplicates skipped, {failed} failed'.format(**self.stats))
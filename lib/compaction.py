@@ -0,0 +1,70 @@
+import json
+import math
+
+
+# Грубая оценка количества токенов в тексте
+def estimate_tokens(text):
+    return math.ceil(len(text) / 3)
+
+
+def estimate_json_tokens(value):
+    return estimate_tokens(json.dumps(value, ensure_ascii=False))
+
+
+# Сокращение данных задачи до заданного бюджета токенов. Описание обрезается до своей доли бюджета,
+# последние комментарии и комментарии с участием исполнителя или автора задачи сохраняются
+# в первую очередь, остальные по мере возможности обрезаются или отбрасываются.
+# Результат зависит только от входных данных
+class PromptCompactor:
+    def __init__(self, budget=3000, keep_recent=3, description_share=0.3, comment_tokens=100):
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.description_share = description_share
+        self.comment_tokens = comment_tokens
+
+    def truncate(self, text, tokens):
+        chars = tokens * 3
+
+        if text is None or len(text) <= chars:
+            return text
+
+        return text[:chars].rstrip() + ' …'
+
+    def compact(self, item):
+        if not self.budget:
+            return item
+
+        item = dict(item)
+        item['description'] = self.truncate(item['description'], int(self.budget * self.description_share))
+
+        comments = item['comments']
+        used = estimate_json_tokens(dict(item, comments=[]))
+
+        # Порядок отбора: сначала последние, затем связанные с исполнителем или автором, затем более новые
+        participants = {item['assignee'], item['reporter']} - {None}
+
+        def relevance(i):
+            comment = comments[i]
+            is_recent = i >= len(comments) - self.keep_recent
+            is_relevant = comment['author'].lstrip('@') in participants or \
+                any('@' + name in comment['body'] for name in participants)
+
+            return is_recent, is_relevant, i
+
+        kept = {}
+
+        for i in sorted(range(len(comments)), key=relevance, reverse=True):
+            for comment in [comments[i], dict(comments[i], body=self.truncate(comments[i]['body'], self.comment_tokens))]:
+                cost = estimate_json_tokens(comment)
+
+                if used + cost <= self.budget:
+                    kept[i] = comment
+                    used += cost
+                    break
+
+        item['comments'] = [kept[i] for i in sorted(kept)]
+
+        if len(kept) < len(comments):
+            item['omitted_comments'] = len(comments) - len(kept)
+
+        return item
@@ -0,0 +1,58 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+# Локальный кэш обработанных задач для инкрементального режима.
+# Для каждой задачи хранится время обновления в Jira и компактная запись задачи: поля,
+# результат collect_data, статистика связей и найденные связанные задачи.
+# Используется из потоков, выполняющих разные запросы, и из процессов, обрабатывающих разные части задач
+class IssueCache:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS records (
+                key TEXT PRIMARY KEY,
+                updated TEXT,
+                record TEXT,
+                saved_at REAL
+            )
+        """)
+
+    # Время обновления задач, сохранённых в кэше
+    def get_updated(self, keys):
+        result = {}
+
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            with self.lock:
+                rows = self.db.execute('SELECT key, updated FROM records WHERE key IN ({})'.format(','.join('?' * len(chunk))),
+                                       chunk).fetchall()
+            result.update(dict(rows))
+
+        return result
+
+    def load(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT record FROM records WHERE key = ?', (key,)).fetchone()
+
+        if row is None:
+            return None
+
+        return json.loads(row[0])
+
+    def save(self, record):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)',
+                            (record.key, record.updated, json.dumps(record.to_dict(), default=str), time.time()))
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
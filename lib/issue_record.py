@@ -0,0 +1,69 @@
+# Компактная запись задачи: только значения, которые читают правила, скоринг и составление промптов.
+# Ресурс Jira с исходным JSON, журналом изменений и комментариями после извлечения данных не хранится
+class IssueRecord:
+    __slots__ = ('key', 'summary', 'description', 'priority', 'status', 'assignee', 'reporter',
+                 'created', 'updated', 'fields', 'data', 'linked', 'stats_linked', 'intents', 'cached')
+
+    # Ключи data и stats_linked. По ним проверяются пути в правилах при загрузке
+    data_keys = ('summary_comments', 'last_comment_time', 'days_since_last_comment', 'created_time',
+                 'days_since_created', 'comments', 'comment_markers', 'activity_comments_count',
+                 'last_activity_comment_time', 'comments_authors_count', 'custom_fields',
+                 'log', 'summary_status', 'summary_assignee', 'last_status_time', 'days_since_last_status',
+                 'max_status_time', 'max_assignee_time')
+    stats_linked_keys = ('total', 'closed', 'closed_perc')
+
+    def __init__(self, key, summary=None, description=None, priority=None, status=None, assignee=None,
+                 reporter=None, created=None, updated=None, fields=None, data=None, linked=None,
+                 stats_linked=None, intents=None, cached=False):
+        self.key = key
+        self.summary = summary
+        self.description = description
+        self.priority = priority
+        self.status = status
+
+        # Имена пользователей. None, если пользователь не указан или удалён
+        self.assignee = assignee
+        self.reporter = reporter
+
+        self.created = created
+        self.updated = updated
+
+        # Исходные значения полей, которые используют правила (fields.<поле>...)
+        self.fields = fields if fields is not None else {}
+
+        self.data = data
+        self.linked = linked
+        self.stats_linked = stats_linked
+        self.intents = intents if intents is not None else []
+        self.cached = cached
+
+    # Запись из ресурса Jira. rule_fields - поля, которые нужно сохранить для правил
+    @classmethod
+    def from_issue(cls, issue, rule_fields=()):
+        raw = issue.raw['fields']
+
+        return cls(key=issue.key,
+                   summary=raw.get('summary'),
+                   description=raw.get('description'),
+                   priority=(raw.get('priority') or {}).get('name'),
+                   status=(raw.get('status') or {}).get('name'),
+                   assignee=cls.active_user(raw.get('assignee')),
+                   reporter=cls.active_user(raw.get('reporter')),
+                   created=raw.get('created'),
+                   updated=raw.get('updated'),
+                   fields={name: raw.get(name) for name in rule_fields})
+
+    # Удалённые пользователи отмечаются в Jira суффиксом [X] в отображаемом имени
+    @staticmethod
+    def active_user(user):
+        if user is None or (user.get('displayName') or '')[-3:] == '[X]':
+            return None
+
+        return user.get('name')
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**{name: values.get(name) for name in cls.__slots__ if name in values})
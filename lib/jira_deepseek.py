@@ -5,77 +5,308 @@ from requests.adapters import HTTPAdapter, Retry
 import random
 import re
 import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from lib.compaction import estimate_tokens
+from lib.metrics import Metrics
+
+
+# Ограничитель количества токенов в минуту (скользящее окно)
+class TokenRateLimiter:
+    window = 60
+
+    def __init__(self, tokens_per_minute=0):
+        self.tokens_per_minute = tokens_per_minute
+        self.spent = deque()
+        self.lock = threading.Condition()
+
+    def acquire(self, tokens):
+        if not self.tokens_per_minute:
+            return
+
+        with self.lock:
+            while True:
+                now = time.monotonic()
+
+                while self.spent and now - self.spent[0][0] >= self.window:
+                    self.spent.popleft()
+
+                used = sum(t for _, t in self.spent)
+
+                # Слишком большой запрос пропускаем, когда окно пустое
+                if used + tokens <= self.tokens_per_minute or not self.spent:
+                    self.spent.append((now, tokens))
+                    return
+
+                self.lock.wait(self.window - (now - self.spent[0][0]))
+
 
 class JiraDeepSeek:
     url = 'https://api.deepseek.com/chat/completions'
+    model = 'deepseek-chat'
     ds_token = ''
     prompts = {}
 
-    def __init__(self, token, prompts, url=''):
+    def __init__(self, token, prompts, url='', pool_size=10, connect_timeout=10, read_timeout=120,
+                 retries=3, backoff_factor=2, stream=False, cache=None, dry_run=False, seed=None,
+                 metrics=None):
         if url:
             self.url = url
 
         self.ds_token = token
         self.prompts = prompts
-
-    def ask(self, prompt, system_prompt=''):
-        headers = {
+        self.stream = stream
+        self.timeout = (connect_timeout, read_timeout)
+        self.latencies = []
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        # Кэш ответов. В режиме dry_run запросы к DeepSeek не отправляются
+        self.cache = cache
+        self.dry_run = dry_run
+        self.cache_stats = {'hits': 0, 'misses': 0, 'tokens_saved': 0, 'tokens_missed': 0}
+        self.stats_lock = threading.Lock()
+
+        # Основа для воспроизводимой случайности при составлении промптов
+        self.seed = seed
+
+        # Долгоживущая сессия с пулом keep-alive соединений
+        self.session = requests.Session()
+        self.session.headers.update({
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.ds_token}"
-        }
+        })
 
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=Retry(total=retries,
+                                                backoff_factor=backoff_factor,
+                                                status_forcelist=[500, 502, 503, 504],
+                                                allowed_methods=None))
+
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    # limiter - ограничитель токенов в минуту. Учитываются только запросы, действительно
+    # отправленные в DeepSeek: ответы из кэша и пропуски в режиме dry_run бюджет не расходуют
+    def ask(self, prompt, system_prompt='', limiter=None):
         default_prompt = self.prompts['default']
+        system_content = default_prompt + ' ' + system_prompt
 
         data = {
-            "model": 'deepseek-chat',
+            "model": self.model,
             # "deepseek-reasoner",  # Use 'deepseek-reasoner' for R1 model or 'deepseek-chat' for V3 model
             "messages": [
-                {"role": "system", "content": default_prompt + ' ' + system_prompt},
+                {"role": "system", "content": system_content},
                 {"role": "user", "content": prompt}
             ],
-            "stream": False
+            "stream": self.stream
         }
 
-        s = requests.Session()
+        tokens = self.estimate_tokens(system_content + prompt)
+        cache_key = None
 
-        retries = Retry(total = 5,
-                        backoff_factor = 15,
-                        status_forcelist = [500, 502, 503, 504])
+        if self.cache is not None:
+            cache_key = self.cache.make_key(self.model, system_content, prompt)
+            cached = self.cache.get(cache_key)
 
-        s.mount('https://', HTTPAdapter(max_retries=retries))
+            with self.stats_lock:
+                if cached is not None:
+                    self.cache_stats['hits'] += 1
+                    self.cache_stats['tokens_saved'] += tokens
+                else:
+                    self.cache_stats['misses'] += 1
+                    self.cache_stats['tokens_missed'] += tokens
+
+            if cached is not None:
+                return cached
+
+        if self.dry_run:
+            return None
+
+        if limiter is not None:
+            limiter.acquire(tokens)
+
+        latency = {'headers': None, 'first_token': None, 'total': None}
+        started = time.perf_counter()
 
         try:
-            response = s.post(self.url, headers=headers, json=data)
+            with self.session.post(self.url, json=data, timeout=self.timeout, stream=self.stream) as response:
+                latency['headers'] = time.perf_counter() - started
 
-            if response.status_code == 200:
-                result = response.json()
+                if response.status_code != 200:
+                    logging.critical('Request to DeepSeek failed: {}'.format(response.status_code))
 
-                content = result['choices'][0]['message']['content']
-                content = re.sub(r"^```json\n", r"", content)
-                content = re.sub(r"```$", r"", content)
+                    return None
 
-                return json.loads(content)
-            else:
-                logging.critical('Request to DeepSeek failed: {}'.format(response.status_cod))
+                usage = {}
 
-                return None
+                if self.stream:
+                    content = self.read_stream(response, latency, started)
+                    self.metrics.inc('llm_response_bytes', len(content.encode()))
+                else:
+                    body = response.json()
+                    content = body['choices'][0]['message']['content']
+                    usage = body.get('usage') or {}
+                    latency['first_token'] = time.perf_counter() - started
+                    self.metrics.inc('llm_response_bytes', len(response.content))
+
+            # Токены по данным DeepSeek, если они есть в ответе, иначе оценка
+            self.metrics.inc('llm_tokens', usage.get('prompt_tokens', tokens), kind='prompt')
+            self.metrics.inc('llm_tokens', usage.get('completion_tokens', self.estimate_tokens(content)), kind='completion')
+
+            content = re.sub(r"^```json\n", r"", content)
+            content = re.sub(r"```$", r"", content)
+            result = json.loads(content)
+
+            if cache_key is not None:
+                self.cache.put(cache_key, result, tokens)
+
+            return result
         except Exception as e:
             logging.critical('Request to DeepSeek failed! {}'.format(str(e)))
 
             return None
+        finally:
+            latency['total'] = time.perf_counter() - started
+            self.latencies.append(latency)
+            self.metrics.add('ask', latency['total'])
+
+            logging.debug('DeepSeek latency: headers {}, first token {}, total {}'.format(
+                *['{:.2f}s'.format(latency[k]) if latency[k] is not None else '-'
+                  for k in ['headers', 'first_token', 'total']]))
+
+    # Разбор потока SSE. Ответ не в формате json и срабатывание фильтра контента
+    # прерывают чтение сразу, не дожидаясь окончания ответа
+    def read_stream(self, response, latency, started):
+        content = ''
+
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+
+            payload = line[5:].strip()
+
+            if payload == '[DONE]':
+                break
+
+            choice = json.loads(payload)['choices'][0]
+
+            if choice.get('finish_reason') == 'content_filter':
+                raise Exception('Response aborted by content filter')
+
+            delta = choice.get('delta', {}).get('content') or ''
+
+            if delta and latency['first_token'] is None:
+                latency['first_token'] = time.perf_counter() - started
+
+            content += delta
+
+            head = re.sub(r"^```(json)?\s*", r"", content.lstrip())
+            if head and head[0] not in '{[' and not '```json'.startswith(content.lstrip()):
+                raise Exception('Response is not json: {}'.format(content[:50]))
+
+        return content
+
+    # Параллельная отправка запросов. Результаты возвращаются в порядке задач,
+    # ошибка одного запроса не прерывает обработку остальных
+    def ask_many(self, tasks, workers=4, tokens_per_minute=0):
+        limiter = TokenRateLimiter(tokens_per_minute)
+
+        def run(task):
+            prompt, system_prompt = task
+
+            try:
+                return self.ask(prompt, system_prompt, limiter=limiter)
+            except Exception as e:
+                logging.critical('Request to DeepSeek failed! {}'.format(str(e)))
+
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(run, task) for task in tasks]
+
+            for future in futures:
+                yield future.result()
+
+    # Пакетная отправка: данные нескольких задач в одном запросе, в ответ ожидается массив
+    # объектов с полем id. Для задач без корректного ответа в массиве выполняется отдельный запрос
+    def ask_many_batched(self, tasks, batch_size=5, workers=4, tokens_per_minute=0):
+        limiter = TokenRateLimiter(tokens_per_minute)
+
+        def ask_limited(prompt, system_prompt):
+            try:
+                return self.ask(prompt, system_prompt, limiter=limiter)
+            except Exception as e:
+                logging.critical('Request to DeepSeek failed! {}'.format(str(e)))
+
+                return None
+
+        def run(batch):
+            prompt = json.dumps([{'id': issue_id, 'instructions': system_prompt, 'issue': item}
+                                 for issue_id, item, system_prompt in batch], ensure_ascii=False)
+            response = ask_limited(prompt, self.prompts['batch'])
+
+            answers = {}
+            if isinstance(response, list):
+                for entry in response:
+                    if self.is_valid_result(entry) and 'id' in entry:
+                        answers[str(entry['id'])] = entry
+
+            results = []
+            for issue_id, item, system_prompt in batch:
+                if issue_id not in answers:
+                    logging.warning('No valid batch answer for {id}, asking separately'.format(id=issue_id))
+                    answers[issue_id] = ask_limited(json.dumps(item, ensure_ascii=False), system_prompt)
+
+                results.append(answers[issue_id])
+
+            return results
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(run, tasks[i:i + batch_size]) for i in range(0, len(tasks), batch_size)]
+
+            for future in futures:
+                yield from future.result()
+
+    # Проверка ответа: текст сообщения и список адресатов
+    def is_valid_result(self, result):
+        return isinstance(result, dict) and isinstance(result.get('message'), str) \
+            and isinstance(result.get('recipients'), list)
+
+    def estimate_tokens(self, text):
+        return estimate_tokens(text)
+
+    # Доля ответов, полученных из кэша
+    def log_cache_stats(self):
+        total = self.cache_stats['hits'] + self.cache_stats['misses']
+
+        if total:
+            logging.info('DeepSeek cache: {hits}/{total} hits ({ratio:.0%}), ~{saved} tokens saved, ~{missed} tokens to send'.format(
+                hits=self.cache_stats['hits'], total=total, ratio=self.cache_stats['hits'] / total,
+                saved=self.cache_stats['tokens_saved'], missed=self.cache_stats['tokens_missed']))
 
     def extra_prompt(self, issue, config={}, actions=[]):
         prompt = ''
 
+        # С заданным seed выбор вариантов промпта для задачи воспроизводим между запусками,
+        # иначе одинаковые данные дали бы разные промпты и промах кэша
+        if self.seed is not None:
+            rnd = random.Random('{seed}:{id}'.format(seed=self.seed, id=issue['id']))
+        else:
+            rnd = random
+
         # Основная задача или связанная
         if issue['intent'] == 'Main':
             # Спрашивать кратко или длинно?
-            if self.norm_prob(issue['score'], 30, 400, 0.4):
+            if self.norm_prob(issue['score'], 30, 400, 0.4, rnd=rnd):
                 prompt += self.prompts['reminder_long']
             else:
                 prompt += self.prompts['reminder_short']
         else:
-            prompt += self.prompts['reminder_related'].format(related_id = issue['related_id'])
+            # От связанной задачи напрямую зависит задача, через которую к ней перешли по цепочке связей,
+            # а не основная задача
+            prompt += self.prompts['reminder_related'].format(related_id = issue.get('via', issue['related_id']))
 
         prompt += self.prompts['reminder_common']
 
@@ -91,7 +322,7 @@ class JiraDeepSeek:
         min_change_days = min(issue['source'].data['days_since_last_comment'], issue['source'].data['days_since_last_status'])
 
         # Слишком давно обновление
-        if self.norm_prob(min_change_days, 30, 60, 0.2):
+        if self.norm_prob(min_change_days, 30, 60, 0.2, rnd=rnd):
             if math.ceil(min_change_days / 30) >= 1:
                 prompt += self.prompts['updated_months_ago'].format(
                     month=math.ceil(min_change_days / 30))
@@ -100,11 +331,11 @@ class JiraDeepSeek:
                     days=min_change_days)
         # Задача создана давно
         else:
-            if self.norm_prob(issue['source'].data['days_since_created'], 20, 100, 0.6):
+            if self.norm_prob(issue['source'].data['days_since_created'], 20, 100, 0.6, rnd=rnd):
                 prompt += self.prompts['created_months_ago']
 
         # В задаче задействовано много людей
-        if self.norm_prob(issue['source'].data['comments_authors_count'], 5, 10, 0.6):
+        if self.norm_prob(issue['source'].data['comments_authors_count'], 5, 10, 0.6, rnd=rnd):
             prompt += self.prompts['involves_many'].format(
                 authors=issue['source'].data['comments_authors_count'])
 
@@ -117,21 +348,21 @@ class JiraDeepSeek:
             prompt += self.prompts['linked_remind']
 
         # У задачи приоритет блокер или крит
-        if issue['source'].fields.priority.name in ['Blocker', 'Critical']:
-            if self.norm_prob(min_change_days, 20, 100, 0.3):
+        if issue['source'].priority in ['Blocker', 'Critical']:
+            if self.norm_prob(min_change_days, 20, 100, 0.3, rnd=rnd):
                 prompt += self.prompts['priority_high'].format(
-                    priority=issue['source'].fields.priority.name)
+                    priority=issue['source'].priority)
 
         # Эмоциональность
         if issue['score'] > 300:
-            if self.norm_prob(issue['score'], 0, 500, 0.2):
+            if self.norm_prob(issue['score'], 0, 500, 0.2, rnd=rnd):
                 prompt += self.prompts['emotional']
 
         return prompt
 
     # Нормализация вероятности событий "Да" и "Нет"
     # На основе значения (val), диапазона (min, max) и отрицательного фактора вероятности (bias)
-    def norm_prob(self, val, min, max, bias=0):
+    def norm_prob(self, val, min, max, bias=0, rnd=random):
         if val > max:
             val = max
 
@@ -145,4 +376,4 @@ class JiraDeepSeek:
 
         weights = [ratio_yes, 1 - ratio_yes]
 
-        return random.choices(population, weights)[0]
+        return rnd.choices(population, weights)[0]
@@ -1,29 +1,196 @@
 import pandas as pd
+import hashlib
 import math
-from jira import JIRA
+import os
+import tempfile
+import time
 from collections import defaultdict
+from concurrent.futures import Future
 from datetime import datetime
-from dateutil import parser
+from lib.changelog import ChangelogAnalyzer, parse_time
+from lib.link_graph import LinkGraph
+from lib.issue_record import IssueRecord
+from lib.scheduler import RequestScheduler
+from lib.metrics import Metrics
+from lib.compaction import PromptCompactor, estimate_json_tokens
+import threading
 import logging as log
 import random
 import json
 import re
 
 class JiraTools:
-    jira = None
+    priority_ratio = {'Blocker': 1.7, 'Critical': 1.5, 'Major': 1.3}
+
+    # Скрытая метка комментария: невидимый якорь в разметке Jira
+    marker_pattern = re.compile(r'\{anchor:jdm-[0-9a-f]+\}')
+
+    # Поля задачи, которые используются при сборе данных, скоринге и составлении промптов
+    base_fields = ['summary', 'description', 'priority', 'assignee', 'reporter', 'created', 'updated',
+                   'issuelinks', 'status', 'comment']
+
+    client = None
     jira_url = ''
     jira_token = ''
     ds_token = ''
 
-    def __init__(self, token, url):
+    def __init__(self, token, url, scheduler=None, metrics=None, fields_cache=None, fields_cache_ttl=86400):
         self.jira_url = url
         self.jira_token = token
-        self.jira = JIRA(options={'server': self.jira_url}, token_auth=self.jira_token)
+        self.client_lock = threading.Lock()
+
+        # Кэш соответствия названий полей их идентификаторам
+        self.fields_cache = fields_cache
+        self.fields_cache_ttl = fields_cache_ttl
+        self.field_ids = None
+        self.clause_ids = None
+        self.fields_lock = threading.Lock()
+
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        # Единая точка отсчёта времени на весь запуск
+        self.now = datetime.now().timestamp()
+        self.changelog = ChangelogAnalyzer(self.now)
+
+        # Счётчик обращений к Jira по типам запросов
+        self.round_trips = defaultdict(int)
+        self.round_trips_lock = threading.Lock()
+
+        # Комментарии, полученные пакетным запросом
+        self.comments = {}
+
+        # Обработанные связанные задачи за время запуска
+        self.related = {}
+
+        # Граф связей всех задач, полученных за время запуска
+        self.graph = LinkGraph()
+
+        # Основные задачи, обработанные за время запуска несколькими запросами
+        self.analyzed = {}
+        self.analyzed_lock = threading.Lock()
+
+        # Поля, запрашиваемые при поиске задач, и поля, которые читают правила
+        self.issue_fields = '*all'
+        self.rule_fields = []
+
+        # Оценка количества токенов в данных задач, отправляемых в DeepSeek
+        self.prompt_tokens = []
+
+    # Клиент Jira создаётся при первом обращении
+    @property
+    def jira(self):
+        if self.client is None:
+            with self.client_lock:
+                if self.client is None:
+                    from jira import JIRA
+
+                    # Повторы запросов выполняет планировщик
+                    self.client = JIRA(options={'server': self.jira_url}, token_auth=self.jira_token, max_retries=0)
+                    self.client._session.hooks['response'].append(self.count_bytes)
+
+        return self.client
+
+    # Соответствие названий полей их идентификаторам. Загружается при первом обращении
+    # из файла кэша, а если он устарел - из Jira
+    @property
+    def all_fields(self):
+        if self.field_ids is None:
+            with self.fields_lock:
+                if self.field_ids is None:
+                    self.field_ids, self.clause_ids = self.load_fields()
+
+        return self.field_ids
+
+    # Соответствие имён полей в JQL их идентификаторам, в том виде, в каком его строит клиент Jira
+    @property
+    def clause_fields(self):
+        if self.clause_ids is None:
+            with self.fields_lock:
+                if self.clause_ids is None:
+                    self.field_ids, self.clause_ids = self.load_fields()
+
+        return self.clause_ids
+
+    def load_fields(self):
+        cached = {}
+
+        if self.fields_cache and os.path.exists(self.fields_cache):
+            with open(self.fields_cache) as stream:
+                try:
+                    cached = json.load(stream)
+                except ValueError:
+                    cached = {}
+
+            # Записи без имён полей в JQL сохранены предыдущей версией и считаются устаревшими
+            entry = cached.get(self.jira_url)
+            if entry and 'clauses' in entry and time.time() - entry['saved_at'] < self.fields_cache_ttl:
+                return entry['fields'], entry['clauses']
+
+        fields = {}
+        clauses = {}
+        for field in self.request('fields', self.jira.fields):
+            fields[field['name']] = field['id']
+
+            for name in field.get('clauseNames', []):
+                clauses[name] = field['id']
+
+        if self.fields_cache:
+            cached[self.jira_url] = {'saved_at': time.time(), 'fields': fields, 'clauses': clauses}
+
+            # Временный файл уникален: кэш могут обновлять одновременно несколько процессов
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.fields_cache)), suffix='.tmp')
+
+            with os.fdopen(fd, 'w') as stream:
+                json.dump(cached, stream)
+
+            os.replace(tmp_path, self.fields_cache)
+
+        return fields, clauses
+
+    # Минимальный набор полей для поиска: поля, используемые в коде, кастомные поля и поля из правил
+    def get_search_fields(self, custom_fields=[], rule_paths=[]):
+        fields = list(self.base_fields)
+
+        for field_name in custom_fields:
+            if field_name in self.all_fields:
+                fields.append(self.all_fields[field_name])
+
+        for path in rule_paths:
+            if path[0] == 'fields' and len(path) > 1:
+                fields.append(path[1])
+                self.rule_fields.append(path[1])
+
+        self.rule_fields = list(dict.fromkeys(self.rule_fields))
+
+        return list(dict.fromkeys(fields))
 
-        self.all_fields = {}
+    # Сравнение объёма и времени разбора первой страницы со всеми полями и с выбранными полями
+    def measure_projection(self, jql, fields, max_results=50, **kwargs):
+        from jira.resources import Issue
 
-        for field in self.jira.fields():
-            self.all_fields[field['name']] = field['id']
+        result = {}
+
+        for name, projection in [('all', '*all'), ('projected', fields)]:
+            started = time.perf_counter()
+            raw = self.request('search', self.jira.search_issues, jql, maxResults=max_results, fields=projection,
+                               json_result=True, **kwargs)
+            fetched = time.perf_counter()
+
+            for item in raw['issues']:
+                Issue(self.jira._options, self.jira._session, raw=item)
+
+            result[name] = {'bytes': len(json.dumps(raw)), 'fetch': fetched - started,
+                            'parse': time.perf_counter() - fetched}
+
+        log.info('Field projection ({count} fields): {projected} bytes instead of {all} ({saved:.0%} saved), '
+                 'fetch {pfetch:.2f}s instead of {afetch:.2f}s, parse {pparse:.3f}s instead of {aparse:.3f}s'.format(
+                     count=len(fields), projected=result['projected']['bytes'], all=result['all']['bytes'],
+                     saved=1 - result['projected']['bytes'] / max(1, result['all']['bytes']),
+                     pfetch=result['projected']['fetch'], afetch=result['all']['fetch'],
+                     pparse=result['projected']['parse'], aparse=result['all']['parse']))
+
+        return result
 
     # Получение значения кастомного поля
     def get_custom_field(self, issue, field_name):
@@ -40,84 +207,303 @@ class JiraTools:
         else:
             return None
 
+    # Все обращения к Jira выполняются через планировщик с учётом количества обращений
+    def request(self, kind, fn, *args, **kwargs):
+        with self.round_trips_lock:
+            self.round_trips[kind] += 1
+
+        with self.metrics.stage('jira_' + kind):
+            return self.scheduler.call(fn, *args, **kwargs)
+
+    # Объём ответов Jira
+    def count_bytes(self, response, *args, **kwargs):
+        self.metrics.inc('jira_response_bytes', len(response.content))
+
+    def search_issues(self, jql, **kwargs):
+        # Клиент Jira при первом поиске сам запрашивает список полей, передаём ему закэшированный.
+        # Клиент ищет в нём имена полей в JQL (clauseNames), а не отображаемые названия
+        if hasattr(self.jira, '_fields_cache_value') and not self.jira._fields_cache_value:
+            self.jira._fields_cache_value = self.clause_fields
+
+        return self.request('search', self.jira.search_issues, jql, **kwargs)
+
+    # Постраничный поиск задач. Страницы запрашиваются по мере обработки предыдущих
+    def iter_issues(self, jql, page_size=50, max_results=300, **kwargs):
+        start_at = 0
+
+        while start_at < max_results:
+            page = self.search_issues(jql, startAt=start_at, maxResults=min(page_size, max_results - start_at), **kwargs)
+
+            if not len(page):
+                break
+
+            yield page
+
+            start_at += len(page)
+
+            if start_at >= page.total:
+                break
+
+    # Освобождаем журнал изменений и комментарии после того, как collect_data их обработал
+    def release_raw(self, issue):
+        issue.changelog = None
+        issue.raw.pop('changelog', None)
+
+        if hasattr(issue.fields, 'comment'):
+            issue.fields.comment = None
+            issue.raw['fields'].pop('comment', None)
+
+    # Сбор данных по задаче и её связям в компактную запись. Исходные данные после обработки освобождаются
+    def analyze_issue(self, issue, custom_fields = []):
+        record = IssueRecord.from_issue(issue, self.rule_fields)
+
+        with self.metrics.stage('collect_data'):
+            record.data = self.collect_data(issue, custom_fields=custom_fields)
+
+        with self.metrics.stage('process_linked'):
+            record.linked, record.stats_linked, record.intents = self.process_linked(issue)
+
+        self.release_raw(issue)
+        self.graph.add(record)
+
+        return record
+
+    # Сбор данных по задаче один раз за запуск. Задачу, найденную несколькими запросами,
+    # обрабатывает первый из них, остальные получают ту же запись
+    def analyze_once(self, issue, custom_fields = []):
+        with self.analyzed_lock:
+            future = self.analyzed.get(issue.key)
+            owner = future is None
+
+            if owner:
+                future = self.analyzed[issue.key] = Future()
+
+        if owner:
+            try:
+                if isinstance(issue, IssueRecord):
+                    record = issue
+                else:
+                    record = self.analyze_issue(issue, custom_fields=custom_fields)
+
+                future.set_result(record)
+            except Exception as exc:
+                future.set_exception(exc)
+
+        return future.result()
+
+    # Пакетная загрузка связанных задач, которых ещё нет в кэше.
+    # Задачи, уже полученные в результатах поиска, повторно не запрашиваются
+    def prefetch_related(self, keys, chunk_size=100):
+        missing = []
+
+        for key in dict.fromkeys(keys):
+            if key in self.related:
+                continue
+
+            if key in self.graph.issues:
+                self.related[key] = self.graph.issues[key]
+            else:
+                missing.append(key)
+
+        chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+
+        with self.metrics.stage('prefetch_related'):
+            results = self.scheduler.map(lambda keys: self.search_issues('key in ({keys})'.format(keys=','.join(keys)),
+                                                                         fields=self.issue_fields, expand='changelog',
+                                                                         maxResults=len(keys)), chunks)
+
+        for keys, found in zip(chunks, results):
+            self.prefetch_comments(found)
+
+            for issue in found:
+                self.related[issue.key] = self.analyze_issue(issue)
+
+            # Недоступные задачи повторно не запрашиваем
+            for key in keys:
+                self.related.setdefault(key, None)
+
+    # Связанные задачи через несколько переходов по графу связей. Для каждого следующего перехода
+    # задачи предыдущего загружаются одним пакетом, если их ещё нет в графе
+    def expand_intents(self, intents, hops=1):
+        for hop in range(2, hops + 1):
+            self.prefetch_related([intent['id'] for key in intents for intent in intents[key]])
+            intents = {key: self.graph.intents(key, hops=hop) for key in intents}
+
+        return intents
+
+    # Связанная задача из кэша
+    def get_related(self, key):
+        if key not in self.related:
+            self.prefetch_related([key])
+
+        return self.related[key]
+
+    # Постраничный поиск части задач. Страницы запрашиваются только с ключами,
+    # полные данные - одним запросом для задач, отобранных key_filter
+    def iter_issues_filtered(self, jql, key_filter, page_size=50, max_results=300, **kwargs):
+        for light_page in self.iter_issues(jql, page_size=page_size, max_results=max_results, fields='updated'):
+            keys = [issue.key for issue in light_page if key_filter(issue.key)]
+
+            if keys:
+                yield list(self.search_issues('key in ({keys})'.format(keys=','.join(keys)),
+                                              maxResults=len(keys), **kwargs))
+
+    # Постраничный поиск в инкрементальном режиме. Полные данные запрашиваются только для задач,
+    # изменившихся со времени предыдущего запуска, остальные восстанавливаются из кэша
+    def iter_issues_incremental(self, jql, cache, page_size=50, max_results=300, key_filter=None, **kwargs):
+        for light_page in self.iter_issues(jql, page_size=page_size, max_results=max_results, fields='updated'):
+            if key_filter:
+                light_page = [issue for issue in light_page if key_filter(issue.key)]
+
+            # Запись из кэша пригодна, если задача не обновлялась и в записи есть все поля, которые читают правила.
+            # Поле, добавленное в правила после сохранения записи, требует повторного запроса задачи
+            cached_updated = cache.get_updated([issue.key for issue in light_page])
+            cached = {}
+            for issue in light_page:
+                if cached_updated.get(issue.key) == issue.fields.updated:
+                    values = cache.load(issue.key)
+
+                    if values and set(self.rule_fields) <= set(values.get('fields') or {}):
+                        cached[issue.key] = values
+
+            changed = [issue.key for issue in light_page if issue.key not in cached]
+
+            fresh = {}
+            if changed:
+                for issue in self.search_issues('key in ({keys})'.format(keys=','.join(changed)),
+                                                maxResults=len(changed), **kwargs):
+                    fresh[issue.key] = issue
+
+            log.info('Incremental page: {changed} changed, {cached} cached'.format(
+                changed=len(fresh), cached=len(cached)))
+
+            page = []
+            for issue in light_page:
+                if issue.key in fresh:
+                    page.append(fresh[issue.key])
+                elif issue.key in cached:
+                    page.append(self.from_cache(cached[issue.key]))
+
+            yield page
+
+    # Восстановление записи задачи из кэша с пересчётом счётчиков дней
+    def from_cache(self, values):
+        record = IssueRecord.from_dict(values)
+        record.data = self.refresh_days(record.data)
+        record.cached = True
+
+        self.graph.add(record)
+
+        return record
+
+    # Пересчёт количества дней относительно текущего момента
+    def refresh_days(self, data, now=None):
+        if now is None:
+            now = self.now
+
+        data['days_since_created'] = math.ceil((now - data['created_time']) / 86400)
+
+        if data['last_status_time']:
+            data['days_since_last_status'] = math.ceil((now - data['last_status_time']) / 86400)
+
+        if data['last_comment_time']:
+            data['days_since_last_comment'] = math.ceil((now - data['last_comment_time']) / 86400)
+
+        return data
+
+    def get_issue(self, key, **kwargs):
+        return self.request('issue', self.jira.issue, key, **kwargs)
+
+    # Комментарии, пришедшие вместе с результатами поиска. None, если их нет или список неполный
+    def get_embedded_comments(self, issue):
+        comment = getattr(issue.fields, 'comment', None)
+
+        if comment is None or not hasattr(comment, 'comments'):
+            return None
+
+        if getattr(comment, 'total', len(comment.comments)) > len(comment.comments):
+            return None
+
+        return comment.comments
+
+    # Комментарии задач страницы, у которых в результатах поиска список неполный.
+    # Поиск возвращает тот же усечённый список, поэтому полные списки запрашиваются параллельно по задачам
+    def prefetch_comments(self, issues):
+        missing = [issue.key for issue in issues
+                   if issue.key not in self.comments and self.get_embedded_comments(issue) is None]
+
+        if not missing:
+            return
+
+        log.info('Fetching full comment threads for {count} issues'.format(count=len(missing)))
+        self.metrics.inc('jira_truncated_comments', len(missing))
+
+        with self.metrics.stage('prefetch_comments'):
+            results = self.scheduler.map(lambda key: self.request('comments', self.jira.comments, key), missing)
+
+        for key, comments in zip(missing, results):
+            self.comments[key] = comments
+
+    # Комментарии задачи: из пакетного запроса, из результатов поиска или отдельным запросом
+    def get_comments(self, issue):
+        if issue.key in self.comments:
+            return self.comments.pop(issue.key)
+
+        comments = self.get_embedded_comments(issue)
+
+        if comments is None:
+            comments = self.request('comments', self.jira.comments, issue)
+
+        return comments
+
+    def log_round_trips(self):
+        log.info('Jira round trips: {total} ({details})'.format(
+            total=sum(self.round_trips.values()),
+            details=', '.join('{k}: {v}'.format(k=k, v=v) for k, v in self.round_trips.items())))
+
+        if self.scheduler.stats['retries']:
+            log.info('Jira retries: {retries}, final rate {rate:.1f} req/s'.format(
+                retries=self.scheduler.stats['retries'], rate=self.scheduler.rate))
+
     def collect_data(self, issue, custom_fields = []):
+        created_time = parse_time(issue.fields.created).timestamp()
+
         result = {
-            'log': [],
-            'summary_status': defaultdict(int),
-            'summary_assignee': defaultdict(int),
             'summary_comments': defaultdict(int),
-            'last_status_time': 0,
-            'days_since_last_status': 0,
             'last_comment_time': 0,
             'days_since_last_comment': 0,
-            'days_since_created': math.ceil(
-                (datetime.now().timestamp() - parser.parse(issue.fields.created).timestamp()) / 86400),
-            'max_status_time': {},
-            'max_assignee_time': {},
+            'created_time': created_time,
+            'days_since_created': self.changelog.days_since(created_time),
             'comments': [],
+            'comment_markers': [],
+            'activity_comments_count': 0,
+            'last_activity_comment_time': 0,
             'comments_authors_count': 0
         }
 
-        last_status_time = None
-        last_assignee_time = None
-
         # Журнал изменений
-        for history in issue.changelog.histories:
-            for change in history.items:
-                dt = parser.parse(history.created)
-
-                # Изменился статус
-                if change.field == 'status':
-                    statuses = {}
-                    statuses['ID'] = issue.key
-                    statuses['fromString'] = change.fromString
-                    statuses['toString'] = change.toString
-                    statuses['created'] = history.created
-                    statuses['author'] = history.author.displayName
-                    result['log'].append(statuses)
-
-                    if (last_status_time != None):
-                        time_spent = dt - last_status_time
-                        result['summary_status'][change.fromString] += time_spent.seconds
-                        result['summary_status']['Total'] += time_spent.seconds
-                        result['last_status_time'] = dt.timestamp()
-                        result['days_since_last_status'] = math.ceil(
-                            (datetime.now().timestamp() - result['last_status_time']) / 86400)
-
-                    last_status_time = dt
-                # Изменился исполнитель
-                elif change.field == 'assignee':
-                    if (last_assignee_time != None):
-                        time_spent = dt - last_assignee_time
-                        result['summary_assignee'][change.fromString] += time_spent.seconds
-
-                    last_assignee_time = dt
-
-        # Определение максимальных значений
-        kk = ['status', 'assignee']
-
-        for k in kk:
-            mt = 0
-            mv = 'None'
-            ma = 'None'
-
-            for item in result['summary_' + k]:
-                if result['summary_' + k][item] > mt:
-                    mt = result['summary_' + k][item]
-                    ma = item
-
-            result['max_' + k + '_time'] = [ma, mt]
+        result.update(self.changelog.analyze(issue))
 
         # Комментарии
-        for c in self.jira.comments(issue):
+        for c in self.get_comments(issue):
             result['summary_comments'][c.author.displayName] += 1
-            result['last_comment_time'] = parser.parse(c.created).timestamp()
-            result['days_since_last_comment'] = math.ceil(
-                (datetime.now().timestamp() - result['last_comment_time']) / 86400)
+            result['last_comment_time'] = parse_time(c.created).timestamp()
+
+            # Метки опубликованных ранее комментариев в промпт не попадают.
+            # Комментарии без метки - активность по задаче, а не напоминания
+            markers = self.marker_pattern.findall(c.body)
+            result['comment_markers'] += markers
 
-            body = self.mentions_to_common(c.body)
+            if not markers:
+                result['activity_comments_count'] += 1
+                result['last_activity_comment_time'] = result['last_comment_time']
+
+            body = self.mentions_to_common(self.marker_pattern.sub('', c.body).rstrip())
             result['comments'].append({'author': '@' + c.author.name, 'body': body, 'is_deleted': True if c.author.displayName[-3:] == '[X]' else False})
 
+        if result['last_comment_time']:
+            result['days_since_last_comment'] = self.changelog.days_since(result['last_comment_time'])
+
         result['comments_authors_count'] = len(result['summary_comments'].keys())
 
         result['custom_fields'] = {}
@@ -127,52 +513,19 @@ class JiraTools:
 
         return result
 
-    # Статистика связанных задач
+    # Связи задачи, их статистика и связанная задача для комментирования
     def process_linked(self, issue):
-        linked = []
-        intents = []
-        stats = {'total': 0, 'closed': 0}
-
-        # Собираем связи. Примеры: is "cloned by", "causes", "relates to". Статусы завершённости: "Done", "Closed"
-        for link in issue.fields.issuelinks:
-            if hasattr(link, "outwardIssue"):
-                outward_issue = link.outwardIssue
-                item = {'id': outward_issue.key, 'type': link.type.outward, 'status': outward_issue.fields.status.name}
-            elif hasattr(link, "inwardIssue"):
-                inward_issue = link.inwardIssue
-                item = {'id': inward_issue.key, 'type': link.type.inward, 'status': inward_issue.fields.status.name}
-            else:
-                item = None
-
-            if item:
-                stats['total'] += 1
-
-                if item['status'] in ("Done", "Closed", "Resolved"):
-                    stats['closed'] += 1
-                    item['is_closed'] = True
-                else:
-                    item['is_closed'] = False
-
-                linked.append(item)
-
-        linked_open = [l for l in linked if l['is_closed'] == False]
-
-        if stats['total'] and stats['closed']:
-            stats['closed_perc'] = round(stats['closed'] / stats['total'], 2) * 100
-        else:
-            stats['closed_perc'] = 0
-
-        if len(linked_open) == 1 and linked_open[0]['type'] == 'relates to':
-            intents.append({'id': linked_open[0]['id']})
+        linked = self.graph.parse(issue)
+        stats, intents = self.graph.summary(linked)
 
         return linked, stats, intents
 
     # Скоринг проблемности задачи
     def get_score(self, issue):
-        priority_ratio = {'Blocker': 1.7, 'Critical': 1.5, 'Major': 1.3}
+        priority_ratio = self.priority_ratio
 
-        if issue.fields.priority.name in priority_ratio:
-            ratio = priority_ratio[issue.fields.priority.name]
+        if issue.priority in priority_ratio:
+            ratio = priority_ratio[issue.priority]
         else:
             ratio = 1
 
@@ -229,18 +582,12 @@ class JiraTools:
     def get_short_data(self, issue, config={}):
         result = {'title': issue['title'],
                   'description': issue['description'],
-                  'comments': [c for c in issue['source'].data['comments'] if len(c) <= 500],
+                  'comments': issue['source'].data['comments'],
                   'intent': 'Main',
-                  'assignee': None,
-                  'reporter': None
+                  'assignee': issue['source'].assignee,
+                  'reporter': issue['source'].reporter
             }
 
-        if issue['source'].fields.assignee is not None and issue['source'].fields.assignee.displayName[-3:] != '[X]':
-            result['assignee'] = issue['source'].fields.assignee.name
-
-        if issue['source'].fields.reporter is not None and issue['source'].fields.reporter.displayName[-3:] != '[X]':
-            result['reporter'] = issue['source'].fields.reporter.name
-
         black_list = []
         if config['my_username']:
             black_list.append(config['my_username'])
@@ -251,6 +598,15 @@ class JiraTools:
 
         result['black_list'] = black_list
 
+        # Сокращаем данные до бюджета токенов
+        tokens_before = estimate_json_tokens(result)
+        result = PromptCompactor(config.get('prompt_token_budget', 0)).compact(result)
+        tokens_after = estimate_json_tokens(result)
+
+        self.prompt_tokens.append(tokens_after)
+        log.debug('Issue {id}: ~{after} prompt tokens ({before} before compaction)'.format(
+            id=issue['id'], after=tokens_after, before=tokens_before))
+
         return result
 
     # Конвертировать указания пользователей в общепринятый формат @username
@@ -268,14 +624,32 @@ class JiraTools:
     def has_mentions(self, text):
         return re.search(r"@([\w.\-_]+)", text, flags = re.IGNORECASE) is not None
 
-    # Добавление комментария
-    def add_comment(self, issue, comment):
-        log.info("Commenting {id}".format(id=issue['source'].key))
+    # Метка комментария для задачи и запуска
+    def comment_marker(self, key, run_id):
+        digest = hashlib.sha1('{key}:{run}'.format(key=key, run=run_id).encode()).hexdigest()
+
+        return '{{anchor:jdm-{hash}}}'.format(hash=digest[:16])
+
+    # Добавление комментария. Запрос мог дойти до Jira, а ответ - потеряться, поэтому перед
+    # повтором комментарий с меткой ищется в задаче и повторно не публикуется
+    def add_comment(self, issue, comment, marker=None):
+        key = issue['source'].key
+        log.info("Commenting {id}".format(id=key))
+
+        attempts = []
+
+        def post():
+            if attempts and marker:
+                for posted in self.jira.comments(key):
+                    if marker in posted.body:
+                        log.info("Comment for {id} was posted by the failed attempt".format(id=key))
+                        return posted
+
+            attempts.append(1)
+
+            return self.jira.add_comment(issue=key, body=comment)
 
-        return self.jira.add_comment(
-           issue = issue['source'],
-           body = comment
-        )
+        return self.request('add_comment', post)
 
     def get_status_time(self, a, s):
         if s not in a.data['summary_status']:
@@ -293,4 +667,4 @@ class JiraTools:
         return self.jira_url + 'browse/' + issue.key
 
     def get_days_since_created(self, issue):
-        return math.ceil((datetime.now().timestamp() - parser.parse(issue.fields.created).timestamp()) / 86400)
+        return self.changelog.days_since(parse_time(issue.created).timestamp())
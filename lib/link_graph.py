@@ -0,0 +1,95 @@
+import threading
+
+
+# Граф связей задач, полученных за время запуска: для каждой задачи список связей с типом
+# и статусом связанной задачи. Статистика связей и связанные задачи для комментирования
+# вычисляются по графу, переходы по уже известным задачам не требуют обращений к Jira
+class LinkGraph:
+    closed_statuses = ("Done", "Closed", "Resolved")
+
+    # Тип связи, по которой переходим к связанной задаче
+    intent_type = 'relates to'
+
+    def __init__(self):
+        self.edges = {}
+        self.issues = {}
+        self.lock = threading.Lock()
+
+    # Связи задачи Jira. Примеры: is "cloned by", "causes", "relates to"
+    def parse(self, issue):
+        edges = []
+
+        for link in issue.fields.issuelinks:
+            if hasattr(link, "outwardIssue"):
+                linked_issue, link_type = link.outwardIssue, link.type.outward
+            elif hasattr(link, "inwardIssue"):
+                linked_issue, link_type = link.inwardIssue, link.type.inward
+            else:
+                continue
+
+            status = linked_issue.fields.status.name
+            edges.append({'id': linked_issue.key, 'type': link_type, 'status': status,
+                          'is_closed': status in self.closed_statuses})
+
+        return edges
+
+    # Добавление записи задачи вместе со связями
+    def add(self, record):
+        with self.lock:
+            self.edges[record.key] = record.linked
+            self.issues[record.key] = record
+
+    # Статистика и связанная задача для комментирования за один проход по связям
+    def summary(self, edges):
+        stats = {'total': 0, 'closed': 0}
+        linked_open = []
+
+        for edge in edges:
+            stats['total'] += 1
+
+            if edge['is_closed']:
+                stats['closed'] += 1
+            else:
+                linked_open.append(edge)
+
+        if stats['total'] and stats['closed']:
+            stats['closed_perc'] = round(stats['closed'] / stats['total'], 2) * 100
+        else:
+            stats['closed_perc'] = 0
+
+        intents = []
+        if len(linked_open) == 1 and linked_open[0]['type'] == self.intent_type:
+            intents.append({'id': linked_open[0]['id']})
+
+        return stats, intents
+
+    # Связанная задача: единственная незакрытая связь нужного типа
+    def intent_target(self, key):
+        linked_open = [edge for edge in self.edges.get(key, []) if not edge['is_closed']]
+
+        if len(linked_open) == 1 and linked_open[0]['type'] == self.intent_type:
+            return linked_open[0]['id']
+
+        return None
+
+    # Цепочка связанных задач длиной до hops переходов. Переход возможен только через задачи,
+    # уже добавленные в граф
+    def intents(self, key, hops=1):
+        intents = []
+        seen = {key}
+
+        for hop in range(1, hops + 1):
+            target = self.intent_target(key)
+
+            if target is None or target in seen:
+                break
+
+            intents.append({'id': target} if hop == 1 else {'id': target, 'hops': hop, 'via': key})
+            seen.add(target)
+
+            if target not in self.edges:
+                break
+
+            key = target
+
+        return intents
@@ -0,0 +1,141 @@
+import json
+import logging as log
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+# Время выполнения этапов обработки и счётчики запуска. Для этапов, выполняющихся параллельно,
+# суммируется время всех потоков. По окончании запуска выгружаются в json или в текстовый файл
+# в формате Prometheus (textfile collector)
+class Metrics:
+    prefix = 'jira_manager'
+
+    def __init__(self):
+        self.stages = defaultdict(lambda: {'count': 0, 'total': 0.0, 'samples': []})
+        self.counters = defaultdict(float)
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, elapsed):
+        with self.lock:
+            self.stages[name]['count'] += 1
+            self.stages[name]['total'] += elapsed
+            self.stages[name]['samples'].append(elapsed)
+
+    # Увеличение счётчика. Метки задаются именованными параметрами
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    # Установка значения счётчика, собранного другим компонентом
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] = value
+
+    # Перцентиль времени выполнения этапа
+    def percentile(self, name, p):
+        samples = sorted(self.stages[name]['samples'])
+
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def log_stages(self):
+        for name, stage in self.stages.items():
+            log.info('Stage {name}: {count} calls, {total:.2f}s total, {avg:.3f}s avg, '
+                     '{p50:.3f}s p50, {p95:.3f}s p95'.format(
+                         name=name, count=stage['count'], total=stage['total'], avg=stage['total'] / stage['count'],
+                         p50=self.percentile(name, 50), p95=self.percentile(name, 95)))
+
+    def summary(self):
+        return {
+            'started': self.started,
+            'duration': time.time() - self.started,
+            'stages': {name: {'count': stage['count'], 'total': stage['total'],
+                              'p50': self.percentile(name, 50), 'p95': self.percentile(name, 95)}
+                       for name, stage in self.stages.items()},
+            'counters': [dict(labels, name=name, value=value) for (name, labels), value in self.counters.items()]
+        }
+
+    def to_prometheus(self):
+        lines = []
+        summary = self.summary()
+
+        lines.append('{p}_run_duration_seconds {v}'.format(p=self.prefix, v=summary['duration']))
+        lines.append('{p}_run_timestamp_seconds {v}'.format(p=self.prefix, v=summary['started']))
+
+        for name, stage in summary['stages'].items():
+            lines.append('{p}_stage_seconds_total{{stage="{s}"}} {v}'.format(p=self.prefix, s=name, v=stage['total']))
+            lines.append('{p}_stage_calls_total{{stage="{s}"}} {v}'.format(p=self.prefix, s=name, v=stage['count']))
+
+            for q in ['p50', 'p95']:
+                lines.append('{p}_stage_seconds{{stage="{s}",quantile="0.{q}"}} {v}'.format(
+                    p=self.prefix, s=name, q=q[1:], v=stage[q]))
+
+        for (name, labels), value in self.counters.items():
+            label_text = ','.join('{k}="{v}"'.format(k=k, v=v) for k, v in labels)
+            lines.append('{p}_{name}{labels} {v}'.format(
+                p=self.prefix, name=name, labels='{' + label_text + '}' if label_text else '', v=value))
+
+        return '\n'.join(lines) + '\n'
+
+    # Выгрузка метрик. Файл заменяется целиком, чтобы сборщик не прочитал его частично.
+    # Временный файл уникален, чтобы процессы частей запуска не мешали друг другу
+    def export(self, path, format='json'):
+        if format == 'prometheus':
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.summary(), indent=2, ensure_ascii=False)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+
+        with os.fdopen(fd, 'w') as stream:
+            stream.write(content)
+
+        # mkstemp создаёт файл, доступный только владельцу, а сборщик метрик может работать от другого пользователя
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+
+# Профилирование запуска: pyinstrument для файлов .html, если он установлен, иначе cProfile.
+# Возвращает функцию, которая останавливает профилирование и сохраняет результат
+def start_profiler(path):
+    if path.endswith('.html'):
+        try:
+            from pyinstrument import Profiler
+
+            profiler = Profiler()
+            profiler.start()
+
+            def stop():
+                profiler.stop()
+
+                with open(path, 'w') as stream:
+                    stream.write(profiler.output_html())
+
+            return stop
+        except ImportError:
+            log.warning('pyinstrument is not installed, using cProfile')
+            path = path[:-len('.html')] + '.prof'
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    def stop():
+        profiler.disable()
+        profiler.dump_stats(path)
+
+    return stop
@@ -0,0 +1,62 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+# Кэш ответов DeepSeek. Ключ - хэш модели, системного промпта и данных задачи.
+# Устаревшие записи удаляются по времени жизни, лишние - по давности последнего использования
+class ResponseCache:
+    def __init__(self, path, ttl=86400 * 7, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                hash TEXT PRIMARY KEY,
+                response TEXT,
+                tokens INTEGER,
+                created REAL,
+                accessed REAL
+            )
+        """)
+
+        with self.lock:
+            self.db.execute('DELETE FROM responses WHERE created < ?', (time.time() - self.ttl,))
+            self.db.commit()
+
+    @staticmethod
+    def make_key(model, system_prompt, prompt):
+        return hashlib.sha256('\0'.join([model, system_prompt, prompt]).encode()).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+
+        with self.lock:
+            row = self.db.execute('SELECT response FROM responses WHERE hash = ? AND created >= ?',
+                                  (key, now - self.ttl)).fetchone()
+
+            if row is None:
+                return None
+
+            self.db.execute('UPDATE responses SET accessed = ? WHERE hash = ?', (now, key))
+            self.db.commit()
+
+        return json.loads(row[0])
+
+    def put(self, key, response, tokens=0):
+        now = time.time()
+
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                            (key, json.dumps(response), tokens, now, now))
+            self.db.execute('DELETE FROM responses WHERE hash IN '
+                            '(SELECT hash FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                            (self.max_entries,))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
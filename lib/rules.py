@@ -1,44 +1,134 @@
+import operator as op
 import re
 from types import NoneType
 
 
+# Условие правила, разобранное при загрузке: путь к значению, оператор и константа
+class Condition:
+    pattern = re.compile(r'(<=|>=|!=|<|>|=)')
+
+    operators = {'<': op.lt, '>': op.gt, '=': op.eq, '!=': op.ne, '>=': op.ge, '<=': op.le}
+
+    def __init__(self, condition):
+        parts = self.pattern.split(condition, maxsplit=1)
+
+        if len(parts) != 3 or not parts[0]:
+            raise ValueError("Invalid condition {condition}".format(condition=condition))
+
+        key, self.operator, self.value = parts
+        self.path = tuple(key.split('.'))
+        self.compare = self.operators[self.operator]
+
+        # Константа, приведённая к типу сравниваемого значения
+        self.constants = {}
+
+    def constant(self, value_type):
+        if value_type not in self.constants:
+            self.constants[value_type] = value_type(self.value)
+
+        return self.constants[value_type]
+
+    def check(self, value):
+        if value is None:
+            return None
+
+        return self.compare(value, self.constant(type(value)))
+
+
 class Rules:
-    # Получение списка действий для выполняющихся правил
-    def get_actions(self, item, rules):
-        actions = []
+    rules = {}
+
+    # roots - допустимые первые части путей, keys - допустимые имена на следующих уровнях:
+    # словарь {префикс пути: имена}, например {('data',): [...], ('data', 'custom_fields'): [...]}
+    def __init__(self, rules=None, roots=None, keys=None):
+        self.compiled = []
+
+        if rules is not None:
+            self.compiled = self.compile(rules, roots, keys)
+
+    # Разбор правил при загрузке. Ошибки в правилах обнаруживаются до начала обработки задач
+    def compile(self, rules, roots=None, keys=None):
+        compiled = []
+
+        known = dict(keys or {})
+        if roots is not None:
+            known[()] = roots
 
         for rule_name in rules:
+            if 'conditions' not in rules[rule_name]:
+                raise ValueError("Rule {name} has no conditions".format(name=rule_name))
+
             if type(rules[rule_name]['conditions']) != list:
                 conditions = [rules[rule_name]['conditions']]
             else:
                 conditions = rules[rule_name]['conditions']
 
-            failed = False
+            conditions = [Condition(str(condition)) for condition in conditions]
 
             for condition in conditions:
-                key, operator, value = re.split(r'(<|>|<=|>=|=|!=)', condition)
+                for i, key_part in enumerate(condition.path):
+                    prefix = condition.path[:i]
 
-                key_parts = key.split('.')
+                    if prefix in known and key_part not in known[prefix]:
+                        raise ValueError("Rule {name}: unknown property {key}".format(
+                            name=rule_name, key='.'.join(condition.path[:i + 1])))
 
-                ptr = item
+            compiled.append((rule_name, conditions))
 
-                for key_part in key_parts:
-                    if hasattr(ptr, key_part):
-                        ptr = getattr(ptr, key_part)
-                    elif type(ptr) == dict and key_part in ptr:
-                        ptr = ptr[key_part]
-                    else:
-                        raise Exception("Failed to get property {name}".format(name=key_part))
+        self.rules = rules
 
-                if not self.compare(ptr,value,operator):
-                    failed = True
-                    break
+        return compiled
+
+    # Пути ко всем значениям, которые используют правила
+    def get_paths(self):
+        return [condition.path for rule_name, conditions in self.compiled for condition in conditions]
 
-            if not failed:
+    # Получение списка действий для выполняющихся правил
+    def get_actions(self, item, rules=None):
+        if rules is not None and rules is not self.rules:
+            self.compiled = self.compile(rules)
+
+        actions = []
+
+        # Значения по уже пройденным путям, общие префиксы разрешаются один раз
+        resolved = {(): item}
+
+        for rule_name, conditions in self.compiled:
+            for condition in conditions:
+                if not condition.check(self.resolve(resolved, condition.path)):
+                    break
+            else:
                 actions.append(rule_name)
 
         return actions
 
+    # Получение списков действий для набора задач за один проход
+    def get_actions_many(self, items):
+        return [self.get_actions(item) for item in items]
+
+    def resolve(self, resolved, path):
+        if path in resolved:
+            return resolved[path]
+
+        ptr = self.resolve(resolved, path[:-1])
+        key_part = path[-1]
+
+        # Пустое значение в середине пути, например незаполненное поле: условие не выполняется
+        if ptr is None:
+            resolved[path] = None
+            return None
+
+        if hasattr(ptr, key_part):
+            ptr = getattr(ptr, key_part)
+        elif type(ptr) == dict and key_part in ptr:
+            ptr = ptr[key_part]
+        else:
+            raise Exception("Failed to get property {name}".format(name=key_part))
+
+        resolved[path] = ptr
+
+        return ptr
+
     # Операторы сравнения
     def compare(self, a, b, operator):
         if type(a) is NoneType and type(b) is not NoneType or type(b) is NoneType and type(a) is not NoneType: return None
@@ -50,4 +140,3 @@ class Rules:
         if operator == '<=': return a <= type(a)(b)
 
         return None
-
@@ -0,0 +1,114 @@
+import logging as log
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Планировщик запросов к Jira. Скорость ограничивается корзиной токенов,
+# количество одновременных запросов - пулом. На 429 и 5xx скорость снижается вдвое
+# и выдерживается пауза (Retry-After или экспоненциальная), после успешных запросов
+# скорость постепенно восстанавливается
+class RequestScheduler:
+    def __init__(self, rate=10, burst=10, workers=4, max_retries=5, backoff=1, min_rate=0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.updated = time.monotonic()
+        self.pause_until = 0
+        self.lock = threading.Lock()
+
+        self.in_flight = threading.BoundedSemaphore(workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        self.stats = defaultdict(int)
+
+    # Ожидание свободного токена
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if now < self.pause_until:
+                    wait = self.pause_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    # Выполнение запроса с повторами
+    def call(self, fn, *args, **kwargs):
+        attempt = 0
+
+        while True:
+            self.acquire()
+
+            try:
+                with self.in_flight:
+                    result = fn(*args, **kwargs)
+            except Exception as e:
+                if not self.is_retryable(e) or attempt >= self.max_retries:
+                    raise
+
+                attempt += 1
+                delay = self.retry_after(e)
+                if delay is None:
+                    delay = self.backoff * 2 ** (attempt - 1)
+
+                log.warning('Jira request failed ({error}), retry {attempt} in {delay:.1f}s'.format(
+                    error=getattr(e, 'status_code', None) or type(e).__name__, attempt=attempt, delay=delay))
+                self.slow_down(delay)
+
+                continue
+
+            self.speed_up()
+
+            return result
+
+    # Параллельное выполнение функции для набора элементов. Порядок результатов сохраняется
+    def map(self, fn, items):
+        return list(self.executor.map(fn, items))
+
+    def is_retryable(self, e):
+        status = getattr(e, 'status_code', None)
+
+        if status is not None:
+            return status == 429 or status >= 500
+
+        # Ошибки соединения и таймауты requests наследуются от OSError
+        return isinstance(e, OSError)
+
+    def retry_after(self, e):
+        response = getattr(e, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+
+        try:
+            return float(headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
+    def slow_down(self, delay):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.pause_until = max(self.pause_until, time.monotonic() + delay)
+            self.stats['retries'] += 1
+
+    def speed_up(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+            self.stats['requests'] += 1
+
+    def shutdown(self):
+        self.executor.shutdown()
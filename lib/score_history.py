@@ -0,0 +1,128 @@
+import glob
+import hashlib
+import importlib.util
+import json
+import logging as log
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+
+# История баллов по запускам в формате Parquet: каталог, в который каждый запуск дописывает свой файл.
+# Для каждой задачи хранится балл, входные данные скоринга, их хэш и хэш отправленного напоминания.
+# По истории пропускаются задачи, которым недавно отправлялось напоминание или которые
+# не изменились с момента последнего напоминания, и строятся отчёты о динамике баллов без обращения к Jira
+class ScoreHistory:
+    columns = ['run_id', 'run_time', 'key', 'score', 'priority', 'status', 'comments_authors_count',
+               'days_since_created', 'days_since_last_comment', 'status_count', 'assignee_count',
+               'inputs_hash', 'comment_hash']
+
+    def __init__(self, path, run_id=None):
+        if importlib.util.find_spec('pyarrow') is None:
+            raise RuntimeError('Score history requires pyarrow (pipenv install pyarrow)')
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        # Суффикс нужен, чтобы запуски, начатые в одну секунду, не заменили снимки друг друга
+        self.run_id = run_id or time.strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        self.run_time = time.time()
+        self.rows = {}
+        self.lock = threading.Lock()
+
+        # Последнее напоминание по каждой задаче
+        history = self.load(columns=['key', 'run_time', 'inputs_hash', 'comment_hash'])
+        reminders = history[history['comment_hash'].notna()].sort_values('run_time')
+        self.reminders = reminders.groupby('key').tail(1).set_index('key')
+
+    # Все снимки истории. Файлы, запись которых не завершилась, не читаются
+    def load(self, columns=None):
+        files = sorted(glob.glob(os.path.join(self.path, '*.parquet')))
+
+        if not files:
+            return pd.DataFrame(columns=columns or self.columns)
+
+        return pd.concat([pd.read_parquet(file, columns=columns) for file in files], ignore_index=True)
+
+    # Хэш входных данных скоринга. Счётчики дней не учитываются: они растут и без изменений в задаче.
+    # Напоминания тоже не учитываются, иначе каждое из них выглядело бы изменением задачи
+    def inputs_hash(self, record):
+        data = record.data
+        inputs = [record.priority, record.status, len(data['summary_status']), len(data['summary_assignee']),
+                  data.get('last_status_time'), data.get('activity_comments_count'),
+                  data.get('last_activity_comment_time')]
+
+        return hashlib.sha1(json.dumps(inputs, default=str).encode()).hexdigest()[:16]
+
+    # Снимок балла задачи в текущем запуске
+    def add(self, record, score):
+        data = record.data
+        row = {'run_id': self.run_id, 'run_time': self.run_time, 'key': record.key, 'score': score,
+               'priority': record.priority, 'status': record.status,
+               'comments_authors_count': data['comments_authors_count'],
+               'days_since_created': data['days_since_created'],
+               'days_since_last_comment': data['days_since_last_comment'],
+               'status_count': len(data['summary_status']), 'assignee_count': len(data['summary_assignee']),
+               'inputs_hash': self.inputs_hash(record), 'comment_hash': None}
+
+        with self.lock:
+            self.rows[record.key] = row
+
+    # Отметка об отправленном напоминании
+    def mark_commented(self, record, score, text):
+        if record.key not in self.rows:
+            self.add(record, score)
+
+        with self.lock:
+            self.rows[record.key]['comment_hash'] = hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    # Причина пропуска задачи или None. remind_interval - минимальный интервал между напоминаниями, дни
+    def skip_reason(self, record, remind_interval=0, skip_unchanged=False):
+        if record.key not in self.reminders.index:
+            return None
+
+        last = self.reminders.loc[record.key]
+        days = (self.run_time - last['run_time']) / 86400
+
+        if remind_interval and days < remind_interval:
+            return 'reminded {days:.1f} days ago'.format(days=days)
+
+        if skip_unchanged and last['inputs_hash'] == self.inputs_hash(record):
+            return 'not changed since the reminder {days:.1f} days ago'.format(days=days)
+
+        return None
+
+    # Запись снимков запуска. Файл заменяется целиком, частично записанный файл не читается
+    def flush(self, name=None):
+        if not self.rows:
+            return
+
+        file = os.path.join(self.path, 'run-{name}.parquet'.format(name=name or self.run_id))
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        os.close(fd)
+
+        pd.DataFrame(list(self.rows.values()), columns=self.columns).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, file)
+
+        log.info('Score history: {count} issues saved to {file}'.format(count=len(self.rows), file=file))
+
+    # Динамика баллов за последние запуски: задачи по строкам, запуски по столбцам
+    def trend(self, runs=10):
+        history = self.load(columns=['run_id', 'run_time', 'key', 'score', 'comment_hash'])
+
+        if history.empty:
+            return history
+
+        run_ids = history.sort_values('run_time')['run_id'].drop_duplicates().tail(runs)
+        history = history[history['run_id'].isin(run_ids)]
+
+        report = history.pivot_table(index='key', columns='run_id', values='score', aggfunc='max')[list(run_ids)]
+        report['change'] = report.ffill(axis=1).iloc[:, -1] - report.bfill(axis=1).iloc[:, 0]
+        report['reminders'] = history[history['comment_hash'].notna()].groupby('key')['run_id'].nunique()
+        report['reminders'] = report['reminders'].fillna(0).astype(int)
+
+        return report.sort_values(list(run_ids)[-1], ascending=False, na_position='last')
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+from lib.issue_record import IssueRecord
+
+
+# Номер части для задачи: стабильный хэш ключа, одинаковый во всех процессах и на всех машинах
+def shard_of(key, shards):
+    return int(hashlib.sha1(key.encode()).hexdigest()[:8], 16) % shards
+
+
+# Координация частей запуска через общий файл SQLite. Каждая часть сохраняет оценённые задачи,
+# последняя завершившаяся часть получает право комментирования и объединяет результаты всех частей,
+# чтобы порог и порядок по баллу применялись ко всему набору задач. Право выдаётся один раз за запуск
+class ShardCoordinator:
+    def __init__(self, path, run_id, shards):
+        self.run_id = run_id
+        self.shards = shards
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS shards (
+                run_id TEXT,
+                shard INTEGER,
+                finished REAL,
+                PRIMARY KEY (run_id, shard)
+            )
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                run_id TEXT,
+                shard INTEGER,
+                key TEXT,
+                score INTEGER,
+                item TEXT,
+                PRIMARY KEY (run_id, key)
+            )
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS commenter (
+                run_id TEXT PRIMARY KEY,
+                shard INTEGER,
+                claimed REAL
+            )
+        """)
+
+    # Сохранение оценённых задач части. Повторный запуск части заменяет её результаты
+    def save_results(self, shard, records):
+        self.db.execute('BEGIN IMMEDIATE')
+        self.db.execute('DELETE FROM results WHERE run_id = ? AND shard = ?', (self.run_id, shard))
+        self.db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                            [(self.run_id, shard, item['id'], item['score'],
+                              json.dumps(self.encode_item(item), ensure_ascii=False, default=str))
+                             for item in records])
+        self.db.execute('COMMIT')
+
+    # Отметка о завершении части. True, если все части завершены и эта часть получила право комментирования
+    def finish(self, shard):
+        self.db.execute('BEGIN IMMEDIATE')
+
+        try:
+            self.db.execute('INSERT OR REPLACE INTO shards VALUES (?, ?, ?)', (self.run_id, shard, time.time()))
+
+            claimed = self.db.execute('SELECT shard FROM commenter WHERE run_id = ?', (self.run_id,)).fetchone()
+            commenter = self.finished_count() >= self.shards and claimed is None
+
+            if commenter:
+                self.db.execute('INSERT INTO commenter VALUES (?, ?, ?)', (self.run_id, shard, time.time()))
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+
+        self.db.execute('COMMIT')
+
+        return commenter
+
+    def finished_count(self):
+        return self.db.execute('SELECT COUNT(*) FROM shards WHERE run_id = ?', (self.run_id,)).fetchone()[0]
+
+    # Результаты всех частей
+    def load_results(self):
+        rows = self.db.execute('SELECT item FROM results WHERE run_id = ? ORDER BY score DESC', (self.run_id,))
+
+        return [self.decode_item(json.loads(row[0])) for row in rows]
+
+    # Задача и связанные задачи с записями, пригодными для передачи между процессами
+    def encode_item(self, item):
+        encoded = dict(item, source=item['source'].to_dict())
+
+        if 'relations' in item:
+            encoded['relations'] = [self.encode_item(related) for related in item['relations']]
+
+        return encoded
+
+    def decode_item(self, item):
+        decoded = dict(item, source=IssueRecord.from_dict(item['source']))
+
+        if 'relations' in item:
+            decoded['relations'] = [self.decode_item(related) for related in item['relations']]
+
+        return decoded
+
+    def close(self):
+        self.db.close()
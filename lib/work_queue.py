@@ -0,0 +1,87 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+
+# Журнал выполнения этапов обработки задач: fetched, scored, prompted, commented.
+# Позволяет продолжить прерванный запуск, не повторяя запросы к DeepSeek и публикацию комментариев
+class WorkQueue:
+    stages = ['fetched', 'scored', 'prompted', 'commented']
+
+    def __init__(self, path, resume=False):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                started REAL,
+                finished REAL
+            )
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                run_id TEXT,
+                key TEXT,
+                stage TEXT,
+                payload TEXT,
+                updated REAL,
+                PRIMARY KEY (run_id, key, stage)
+            )
+        """)
+
+        row = None
+        if resume:
+            row = self.db.execute('SELECT run_id FROM runs WHERE finished IS NULL ORDER BY started DESC LIMIT 1').fetchone()
+
+        if row:
+            self.run_id = row[0]
+            self.resumed = True
+        else:
+            self.run_id = time.strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:8]
+            self.resumed = False
+            self.db.execute('INSERT INTO runs VALUES (?, ?, NULL)', (self.run_id, time.time()))
+
+        self.db.commit()
+
+    def mark(self, key, stage, payload=None):
+        self.mark_many([key], stage, payload)
+
+    def mark_many(self, keys, stage, payload=None):
+        if stage not in self.stages:
+            raise ValueError("Unknown stage {stage}".format(stage=stage))
+
+        now = time.time()
+
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)',
+                                [(self.run_id, key, stage, json.dumps(payload, ensure_ascii=False), now) for key in keys])
+            self.db.commit()
+
+    # Данные этапа или None, если этап для задачи не выполнялся
+    def get(self, key, stage):
+        with self.lock:
+            row = self.db.execute('SELECT payload FROM items WHERE run_id = ? AND key = ? AND stage = ?',
+                                  (self.run_id, key, stage)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def is_done(self, key, stage):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM items WHERE run_id = ? AND key = ? AND stage = ?',
+                                   (self.run_id, key, stage)).fetchone() is not None
+
+    def count(self, stage):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM items WHERE run_id = ? AND stage = ?',
+                                   (self.run_id, stage)).fetchone()[0]
+
+    def finish(self):
+        with self.lock:
+            self.db.execute('UPDATE runs SET finished = ? WHERE run_id = ?', (time.time(), self.run_id))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -1,15 +1,14 @@
 import sys
 from xmlrpc.client import boolean
 
-import pandas as pd
+import os
 import json
 import argparse
 import logging as log
 import time
 import yaml
-from lib.jira_deepseek import JiraDeepSeek
-from lib.jira_tools import JiraTools
 from lib.rules import Rules
+from lib.issue_record import IssueRecord
 
 parser = argparse.ArgumentParser(description="Runtime parameters",
                                  formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -20,32 +19,80 @@ parser.add_argument('--disable_mentions',       help='Avoid user mentions in com
 parser.add_argument('-ju', '--jira_url',        help='Jira url',                         required=True)
 parser.add_argument('-jt', '--jira_token',      help='Jira access token',                required=True)
 parser.add_argument('--jira_query_file',        help='Jira query file',                  required=True)
+parser.add_argument('--queries',                help='Named queries to run concurrently, comma-separated ("all" - every query in the file)',  default='default')
 parser.add_argument('-du', '--deepseek_url',    help='Deepseek url')
 parser.add_argument('-dt', '--deepseek_token',  help='Deepseek access token',            required=True)
 parser.add_argument('--max_jira_results',       help='Max Jira issues to fetch',         default=300, type=int)
-parser.add_argument('--jira_batch_size',        help='Jira batch size',                  default=5, type=int)
-parser.add_argument('--jira_batch_sleep',       help='Sleep n seconds between batches',  default=1, type=int)
+parser.add_argument('--jira_page_size',         help='Jira search page size',            default=50, type=int)
+parser.add_argument('--comment_per_page',       help='Comment issues as soon as each search page is scored',  action='store_true')
+parser.add_argument('--link_hops',              help='Follow "relates to" links up to this many hops to find related issues',  default=1, type=int)
+parser.add_argument('--enrich_workers',         help='Threads for per-issue data collection',  default=4, type=int)
+parser.add_argument('--incremental',            help='Reuse cached data for issues not updated since the previous run',  action='store_true')
+parser.add_argument('--issue_cache',            help='Issue cache file for incremental mode',  default='issue_cache.sqlite')
+parser.add_argument('--jira_rate',              help='Max Jira requests per second',     default=10, type=float)
+parser.add_argument('--jira_workers',           help='Max concurrent Jira requests',     default=4, type=int)
+parser.add_argument('--jira_batch_size',        help='Deprecated and ignored, use --jira_page_size',  type=int)
+parser.add_argument('--jira_batch_sleep',       help='Deprecated and ignored, use --jira_rate',  type=int)
+parser.add_argument('--work_queue',             help='Work queue file to record per-issue progress (disabled if not set)')
+parser.add_argument('--resume',                 help='Resume the last unfinished run recorded in the work queue',  action='store_true')
 parser.add_argument('--comments_log',           help='Log comments to a file log')
+parser.add_argument('--comment_workers',        help='Threads posting comments to Jira',  default=2, type=int)
+parser.add_argument('--comment_queue',          help='Max comments waiting to be posted',  default=20, type=int)
+parser.add_argument('--comment_run_id',         help='Scope of the hidden marker that prevents duplicate comments (default: current date)')
 parser.add_argument('--prompts_file',           help='Prompts yml file location',        default='prompts.yml')
 parser.add_argument('--score_limit',            help='Comment issues if score is greater than score_limit',  default=100, type=int)
 parser.add_argument('--related_score_limit',    help='Comment related issues if score is greater than score_limit',  default=50, type=int)
+parser.add_argument('--deepseek_workers',       help='Max concurrent DeepSeek requests', default=4, type=int)
+parser.add_argument('--deepseek_tpm',           help='DeepSeek tokens per minute limit (0 - unlimited)',  default=0, type=int)
+parser.add_argument('--prompt_token_budget',    help='Token budget for issue data sent to DeepSeek (0 - unlimited)',  default=3000, type=int)
+parser.add_argument('--deepseek_batch_size',    help='Issues per DeepSeek request (1 - one request per issue)',  default=1, type=int)
+parser.add_argument('--deepseek_timeout',       help='DeepSeek read timeout, seconds',   default=120, type=int)
+parser.add_argument('--deepseek_stream',        help='Read DeepSeek responses as a token stream',  action='store_true')
+parser.add_argument('--response_cache',         help='DeepSeek response cache file (disabled if not set)')
+parser.add_argument('--response_cache_ttl',     help='DeepSeek response cache TTL, hours',  default=168, type=int)
+parser.add_argument('--response_cache_size',    help='Max DeepSeek responses kept in cache',  default=10000, type=int)
+parser.add_argument('--dry_run',                help='Do not send requests to DeepSeek or post comments, only report cache hits',  action='store_true')
+parser.add_argument('--prompt_seed',            help='Seed for reproducible per-issue prompt variants')
+parser.add_argument('--fields_cache',           help='Jira fields metadata cache file',  default='fields_cache.json')
+parser.add_argument('--fields_cache_ttl',       help='Jira fields metadata cache TTL, hours',  default=24, type=int)
+parser.add_argument('--metrics_file',           help='Write run metrics to a file at the end of the run')
+parser.add_argument('--metrics_format',         help='Metrics file format',  choices=['json', 'prometheus'], default='json')
+parser.add_argument('--profile',                help='Profile the run: .html - pyinstrument (if installed), otherwise cProfile stats')
+parser.add_argument('--score_history',          help='Score history directory (Parquet, disabled if not set)')
+parser.add_argument('--remind_interval',        help='Do not remind about an issue again within this many days (0 - no limit)',  default=0, type=float)
+parser.add_argument('--skip_unchanged',         help='Do not remind about issues that have not changed since the last reminder',  action='store_true')
+parser.add_argument('--history_report',         help='Print score trends for the last N runs from the score history and exit',  type=int)
+parser.add_argument('--shards',                 help='Split issues into this many parts by issue key hash, each processed by a separate process',  default=1, type=int)
+parser.add_argument('--shard',                  help='Process only this part (0-based), e.g. on a separate host. Without it all parts run as local processes',  type=int)
+parser.add_argument('--shard_run',              help='Run ID shared by all parts of a sharded run (required with --shard)')
+parser.add_argument('--shard_db',               help='Coordination file shared by all parts of a sharded run',  default='shards.sqlite')
+parser.add_argument('--check_config',           help='Validate query, rules and prompts files and exit',  action='store_true')
 parser.add_argument('--my_username',            help='Jira username for given Jira token to exclude from mentions (e.g. john.doe)')
 
 args = parser.parse_args()
 config = vars(args)
 
 # Включаем журналирование
+if config['shard'] is not None:
+    log_format = "%(levelname)s: [shard {shard}] %(message)s".format(shard=config['shard'])
+else:
+    log_format = "%(levelname)s: %(message)s"
+
 if config['verbose']:
-    log.basicConfig(format="%(levelname)s: %(message)s", level=log.DEBUG)
+    log.basicConfig(format=log_format, level=log.DEBUG)
     log.info("Verbose output.")
 else:
-    log.basicConfig(format="%(levelname)s: %(message)s", level=log.INFO)
+    log.basicConfig(format=log_format, level=log.INFO)
+
+# Устаревшие параметры принимаются, чтобы не ломать существующие сценарии запуска
+if config['jira_batch_size'] is not None or config['jira_batch_sleep'] is not None:
+    log.warning("--jira_batch_size and --jira_batch_sleep are deprecated and ignored, "
+                "use --jira_page_size and --jira_rate instead")
 
 # Читаем запросы и фильтры
 with open(config['jira_query_file']) as stream:
     try:
         queries = yaml.safe_load(stream)
-        jira_query = queries['queries']['default']
         if 'custom_fields' in queries:
             custom_fields = queries['custom_fields']
         else:
@@ -54,6 +101,40 @@ with open(config['jira_query_file']) as stream:
     except yaml.YAMLError as exc:
         log.critical(exc)
 
+# Запрос задаётся строкой JQL или словарём с ключами jql и rules. Правила запроса дополняют общие.
+# Правила разбираются при загрузке, ошибка в правилах останавливает запуск до обращения к Jira
+jira_queries = {}
+query_rules = {}
+
+try:
+    for name, query in queries['queries'].items():
+        rules_set = dict(queries.get('rules') or {})
+
+        if isinstance(query, dict):
+            if 'jql' not in query:
+                raise ValueError("Query {name} has no jql".format(name=name))
+
+            rules_set.update(query.get('rules') or {})
+            query = query['jql']
+
+        jira_queries[name] = query
+        query_rules[name] = Rules(rules_set, roots=['key', 'fields', 'data', 'linked', 'stats_linked'],
+                                  keys={('data',): IssueRecord.data_keys,
+                                        ('data', 'custom_fields'): custom_fields,
+                                        ('stats_linked',): IssueRecord.stats_linked_keys})
+
+    if config['queries'] != 'all':
+        names = [name.strip() for name in config['queries'].split(',') if name.strip()]
+
+        for name in names:
+            if name not in jira_queries:
+                raise ValueError("Unknown query {name}".format(name=name))
+
+        jira_queries = {name: jira_queries[name] for name in names}
+except ValueError as exc:
+    log.critical(exc)
+    sys.exit(1)
+
 # Читаем промпты
 with open(config['prompts_file']) as stream:
     try:
@@ -61,112 +142,368 @@ with open(config['prompts_file']) as stream:
     except yaml.YAMLError as exc:
         log.critical(exc)
 
-j = JiraTools(token=config['jira_token'], url=config['jira_url'])
-ds = JiraDeepSeek(token=config['deepseek_token'], url=config['deepseek_url'], prompts=prompts)
-rules = Rules()
+# Пакетный режим требует отдельного системного промпта, которого может не быть в старых файлах промптов
+if config['deepseek_batch_size'] > 1 and 'batch' not in (prompts or {}):
+    log.critical("--deepseek_batch_size > 1 requires a 'batch' prompt in {file}".format(file=config['prompts_file']))
+    sys.exit(1)
+
+# Dry run только показывает комментарии и не публикует их
+if config['dry_run'] and config['mode'] == 'comment':
+    log.critical("--dry_run cannot be combined with --mode comment")
+    sys.exit(1)
+
+if config['check_config']:
+    log.info("Configuration is valid.")
+    sys.exit(0)
+
+# Выполнение по частям: задачи распределяются по стабильному хэшу ключа. Без --shard все части
+# запускаются локальными процессами, с --shard процесс выполняет одну часть, например на отдельной машине.
+# Комментирует задачи всех частей та часть, которая завершилась последней
+if config['shards'] > 1:
+    if config['comment_per_page'] or config['work_queue']:
+        log.critical("Sharded runs do not support --comment_per_page and --work_queue")
+        sys.exit(1)
+
+    if config['shard'] is None:
+        import subprocess
+        import uuid
+
+        shard_run = config['shard_run'] or time.strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        log.info("Starting {shards} shards, run {run}".format(shards=config['shards'], run=shard_run))
+
+        processes = [subprocess.Popen([sys.executable] + sys.argv + ['--shard', str(shard), '--shard_run', shard_run])
+                     for shard in range(config['shards'])]
+
+        sys.exit(max(process.wait() for process in processes))
+
+    if not config['shard_run'] or not 0 <= config['shard'] < config['shards']:
+        log.critical("--shard requires --shard_run and must be less than --shards")
+        sys.exit(1)
+
+    # Файлы метрик и профилирования у каждой части свои
+    for name in ['metrics_file', 'profile']:
+        if config[name]:
+            root, ext = os.path.splitext(config[name])
+            config[name] = '{root}.shard{shard}{ext}'.format(root=root, shard=config['shard'], ext=ext)
+elif config['shard'] is not None:
+    log.critical("--shard requires --shards greater than 1")
+    sys.exit(1)
+
+# Тяжёлые модули загружаются только после проверки параметров и конфигурации
+import pandas as pd
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from lib.jira_deepseek import JiraDeepSeek
+from lib.jira_tools import JiraTools
+from lib.issue_cache import IssueCache
+from lib.response_cache import ResponseCache
+from lib.scheduler import RequestScheduler
+from lib.metrics import Metrics, start_profiler
+from lib.work_queue import WorkQueue
+from lib.comment_poster import CommentPoster
+from lib.shard_coordinator import ShardCoordinator, shard_of
+from lib.score_history import ScoreHistory
+
+# История баллов. Каждая часть запуска пишет свой файл
+if config['score_history']:
+    try:
+        score_history = ScoreHistory(config['score_history'], run_id=config['shard_run'] if config['shard'] is not None else None)
+    except RuntimeError as exc:
+        log.critical(exc)
+        sys.exit(1)
+
+    if config['history_report']:
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(score_history.trend(runs=config['history_report']).to_string())
+        sys.exit(0)
+elif config['history_report']:
+    log.critical("--history_report requires --score_history")
+    sys.exit(1)
+else:
+    score_history = None
+
+stop_profiler = start_profiler(config['profile']) if config['profile'] else None
 
-# Получаем список задач из Jira
-log.info("Fetching issues...")
-issues = j.jira.search_issues(jira_query,
-    expand='changelog', maxResults=config['max_jira_results'])
+if config['response_cache']:
+    response_cache = ResponseCache(config['response_cache'], ttl=config['response_cache_ttl'] * 3600,
+                                   max_entries=config['response_cache_size'])
+else:
+    response_cache = None
+
+scheduler = RequestScheduler(rate=config['jira_rate'], burst=max(1, int(config['jira_rate'])),
+                             workers=config['jira_workers'])
+metrics = Metrics()
+j = JiraTools(token=config['jira_token'], url=config['jira_url'], scheduler=scheduler, metrics=metrics,
+              fields_cache=config['fields_cache'], fields_cache_ttl=config['fields_cache_ttl'] * 3600)
+ds = JiraDeepSeek(token=config['deepseek_token'], url=config['deepseek_url'], prompts=prompts,
+                  pool_size=config['deepseek_workers'], read_timeout=config['deepseek_timeout'],
+                  stream=config['deepseek_stream'], cache=response_cache, dry_run=config['dry_run'],
+                  seed=config['prompt_seed'], metrics=metrics)
+
+# Обработка записи задачи: правила запроса, балл, связанные задачи
+def process_issue(issue, intents, query):
+    with metrics.stage('get_actions'):
+        actions = query_rules[query].get_actions(issue)
+
+    if 'skip' in actions:
+        log.info("Skipping issue {key} due to {query} query rules".format(key=issue.key, query=query))
+        return None
+
+    item = {
+                'id': issue.key,
+                'title': issue.summary,
+                'description': issue.description,
+                'url': j.get_issue_url(issue),
+                'score': None,
+                'source': issue,
+                'intent': 'Main',
+                'relations': [],
+                'actions': actions,
+                'queries': [query]
+    }
+
+    # Добавляем связанные задачи в список обработки
+    for intent in intents:
+        intent_issue = j.get_related(intent['id'])
+
+        if intent_issue:
+            item['relations'].append({
+                'id': intent_issue.key,
+                'title': intent_issue.summary,
+                'description': intent_issue.description,
+                'url': j.get_issue_url(intent_issue),
+                'score': None,
+                'source': intent_issue,
+                'intent': 'Related',
+                'related_id': issue.key,
+                'hops': intent.get('hops', 1),
+                'via': intent.get('via', issue.key),
+                'actions': []
+            })
+
+    return item
+
+
+# Обработка страницы результатов поиска
+def process_page(page, query):
+    records = []
+
+    # Комментарии, которых нет в результатах поиска, запрашиваем одним пакетом
+    j.prefetch_comments([issue for issue in page if not isinstance(issue, IssueRecord) and issue.key not in j.analyzed])
+
+    # Сбор данных по задачам страницы в нескольких потоках. Задачи из кэша уже обработаны.
+    # При выполнении нескольких запросов задача, найденная каждым из них, обрабатывается один раз.
+    # Ресурсы Jira заменяются компактными записями и дальше не хранятся
+    def enrich_issue(issue):
+        if len(jira_queries) > 1:
+            return j.analyze_once(issue, custom_fields=custom_fields)
+
+        if isinstance(issue, IssueRecord):
+            return issue
+
+        return j.analyze_issue(issue, custom_fields=custom_fields)
+
+    with metrics.stage('enrich_page'):
+        page = list(enrich_pool.map(enrich_issue, page))
+
+    intents = {issue.key: issue.intents for issue in page}
+
+    if issue_cache:
+        for issue in page:
+            if not issue.cached:
+                issue_cache.save(issue)
+
+        issue_cache.commit()
+
+    if work_queue:
+        work_queue.mark_many([issue.key for issue in page], 'fetched')
+
+    if config['link_hops'] > 1:
+        with metrics.stage('expand_intents'):
+            intents = j.expand_intents(intents, hops=config['link_hops'])
+
+    # Связанные задачи всей страницы запрашиваем одним пакетом
+    j.prefetch_related([intent['id'] for key in intents for intent in intents[key]])
+
+    with metrics.stage('process_page'):
+        for item in enrich_pool.map(lambda issue: process_issue(issue, intents[issue.key], query), page):
+            if item:
+                records.append(item)
+
+    # Скоринг основных и связанных задач страницы
+    scored = records + [related for item in records for related in item['relations']]
+
+    with metrics.stage('get_score'):
+        for item in scored:
+            item['score'] = j.get_score(item['source'])
+
+    if work_queue:
+        for item in scored:
+            work_queue.mark(work_key(item), 'scored', {'score': item['score']})
+
+    if score_history:
+        for item in scored:
+            score_history.add(item['source'], item['score'])
+
+    return records
+
+
+# Объединение результатов запросов по ключу задачи. Задача, найденная несколькими запросами,
+# получает действия правил каждого из них. Возвращаются задачи, которых ещё не было
+def merge_records(records):
+    new_records = []
+
+    with merge_lock:
+        for item in records:
+            known = merged.get(item['id'])
 
-if not len(issues):
-    log.info("No Jira issues found!")
-    quit()
+            if known is None:
+                merged[item['id']] = item
+                new_records.append(item)
+                continue
+
+            known['actions'] += [action for action in item['actions'] if action not in known['actions']]
+            known['queries'] += item['queries']
+
+    return new_records
+
+
+# Выполнение одного запроса: страницы обрабатываются по мере получения
+def run_query(query):
+    issues_count = 0
+
+    # Задачи своей части
+    if config['shard'] is not None:
+        key_filter = lambda key: shard_of(key, config['shards']) == config['shard']
+    else:
+        key_filter = None
+
+    if config['incremental']:
+        issues_pages = j.iter_issues_incremental(jira_queries[query], issue_cache, page_size=config['jira_page_size'],
+                                                 max_results=config['max_jira_results'], key_filter=key_filter,
+                                                 fields=j.issue_fields, expand='changelog')
+    elif key_filter:
+        issues_pages = j.iter_issues_filtered(jira_queries[query], key_filter, page_size=config['jira_page_size'],
+                                              max_results=config['max_jira_results'], fields=j.issue_fields,
+                                              expand='changelog')
+    else:
+        issues_pages = j.iter_issues(jira_queries[query], page_size=config['jira_page_size'],
+                                     max_results=config['max_jira_results'], fields=j.issue_fields,
+                                     expand='changelog')
+
+    for page in issues_pages:
+        issues_count += len(page)
+        page_records = process_page(page, query)
+
+        if len(jira_queries) > 1:
+            page_records = merge_records(page_records)
+
+        if config['comment_per_page']:
+            with comment_lock:
+                comment_issues(page_records)
+        else:
+            records.extend(page_records)
+
+    log.info('Query {query}: {count} issues'.format(query=query, count=issues_count))
+    metrics.set('query_issues', issues_count, query=query)
+
+    return issues_count
+
+
+# Ключ задачи в журнале этапов. Связанная задача учитывается отдельно для каждой основной
+def work_key(issue):
+    if issue['intent'] == 'Related':
+        return '{id}<{related_id}'.format(id=issue['id'], related_id=issue['related_id'])
 
-df = pd.DataFrame(
-    columns=['id', 'title', 'description', 'url', 'title_url', 'score', 'source', 'intent', 'relations']
-)
+    return issue['id']
 
-batch_size = config['jira_batch_size']
 
-# Получаем комментарии к задачам, считаем балл
-for i in range(0, len(issues), batch_size):
-    log.info("Fetching issue details...")
+# Комментирование задач в порядке убывания балла
+def comment_issues(records):
+    df = pd.DataFrame.from_records(
+        records, columns=['id', 'title', 'description', 'url', 'title_url', 'score', 'source', 'intent', 'relations', 'actions']
+    )
 
-    for issue in issues[i:i + batch_size]:
-        issue.data = j.collect_data(issue, custom_fields=custom_fields)
-        issue.linked, issue.stats_linked, intents = j.process_linked(issue)
+    df_sorted = (df.query("score > 0")
+                 .sort_values('score', axis=0, ascending=False, ignore_index=True)
+                 )
 
-        actions = rules.get_actions(issue, queries['rules'])
+    # Готовим запросы к DeepSeek в порядке убывания балла
+    tasks = []
 
-        if 'skip' in actions:
-            log.info("Skipping issue {key} due to rules".format(key=issue.key))
+    for i, root_issue in df_sorted.iterrows():
+        # Пропускаем задачу, если балл ниже порогового значения
+        if config['mode'] == 'skip' or root_issue['score'] < config['score_limit']:
+            log.info('Skipping issue {id} with score {score}'.format(id=root_issue['id'], score=root_issue['score']))
             continue
 
-        item = {
-                    'id': issue.key,
-                    'title': issue.fields.summary,
-                    'description': issue.fields.description,
-                    'url': j.get_issue_url(issue),
-                    'score': j.get_score(issue),
-                    'source': issue,
-                    'intent': 'Main',
-                    'relations': []
-        }
-
-        # Добавляем связанные задачи в список обработки
-        for intent in intents:
-            intent_issue = j.jira.issue(intent['id'], expand='changelog')
-
-            if intent_issue:
-                intent_issue.data = j.collect_data(intent_issue)
-                intent_issue.linked, intent_issue.stats_linked, intent_intents = j.process_linked(issue)
-
-                item['relations'].append({
-                    'id': intent_issue.key,
-                    'title': intent_issue.fields.summary,
-                    'description': intent_issue.fields.description,
-                    'url': j.get_issue_url(intent_issue),
-                    'score': j.get_score(intent_issue),
-                    'source': intent_issue,
-                    'intent': 'Related',
-                    'related_id': issue.key
-                })
-
-        # Добавляем записи в датафрейм
-        df.loc[len(df)] = item
-
-    # Пауза
-    time.sleep(config['jira_batch_sleep'])
-
-# Сортируем задачи в порядке убывания балла
-df_sorted = (df.query("score > 0")
-             .sort_values('score', axis=0, ascending=False, ignore_index=True)
-             )
-
-# Файл для журналирования событий комментирования
-if config['mode'] == 'comment' and config['comments_log']:
-    comments_log_file = open(config['comments_log'], "w")
-else:
-    comments_log_file = None
-
-for i, root_issue in df_sorted.iterrows():
-    # Пропускаем задачу, если балл ниже порогового значения
-    if config['mode'] == 'skip' or root_issue['score'] < config['score_limit']:
-        log.info('Skipping issue {id} with score {score}'.format(id=root_issue['id'], score=root_issue['score']))
-        continue
-
-    # Собираем набор задач: основная и вложенные
-    issues_set = [root_issue]
-    for related_issue in root_issue['relations']:
-        issues_set.append(related_issue)
-
-    for issue in issues_set:
-        # Обрабатывать вложенные задачи?
-        if issue['intent'] == 'Related':
-            if not config['comment_related'] or issue['score'] < config['related_score_limit']:
-                log.info('Skipping related issues {id} with score {score}'.format(id=issue['id'], score=issue['score']))
+        # Собираем набор задач: основная и вложенные
+        issues_set = [root_issue]
+        for related_issue in root_issue['relations']:
+            issues_set.append(related_issue)
+
+        for issue in issues_set:
+            # Обрабатывать вложенные задачи?
+            if issue['intent'] == 'Related':
+                if not config['comment_related'] or issue['score'] < config['related_score_limit']:
+                    log.info('Skipping related issues {id} with score {score}'.format(id=issue['id'], score=issue['score']))
+                    continue
+
+            # Напоминание отправлялось недавно или задача с тех пор не изменилась
+            if score_history:
+                reason = score_history.skip_reason(issue['source'], config['remind_interval'], config['skip_unchanged'])
+
+                if reason:
+                    log.info('Skipping issue {id}: {reason}'.format(id=issue['id'], reason=reason))
+                    metrics.inc('history_skipped')
+                    continue
+
+            # Задача уже прокомментирована в прерванном запуске
+            if work_queue and work_queue.is_done(work_key(issue), 'commented'):
+                log.info('Issue {id} already commented in run {run}'.format(id=issue['id'], run=work_queue.run_id))
+                continue
+
+            # Комментарий с меткой запуска уже есть в задаче: запрос к DeepSeek не нужен
+            if comment_poster and comment_poster.is_duplicate(issue):
+                comment_poster.skip_duplicate(issue)
                 continue
 
-        item_short = j.get_short_data(issue, config)
+            with metrics.stage('get_short_data'):
+                item_short = j.get_short_data(issue, config)
+
+            with metrics.stage('extra_prompt'):
+                prompt = ds.extra_prompt(issue, config, issue['actions'])
+
+            # Ответ, полученный в прерванном запуске, используем повторно
+            result = work_queue.get(work_key(issue), 'prompted') if work_queue else None
+
+            tasks.append({'issue': issue, 'item_short': item_short, 'prompt': prompt, 'result': result})
+
+    # Запросы выполняются параллельно, комментарии публикуются в порядке балла
+    pending = [task for task in tasks if task['result'] is None]
+
+    if config['deepseek_batch_size'] > 1:
+        results = ds.ask_many_batched([(task['issue']['id'], task['item_short'], task['prompt']) for task in pending],
+                                      batch_size=config['deepseek_batch_size'], workers=config['deepseek_workers'],
+                                      tokens_per_minute=config['deepseek_tpm'])
+    else:
+        results = ds.ask_many([(json.dumps(task['item_short'], ensure_ascii=False), task['prompt']) for task in pending],
+                              workers=config['deepseek_workers'], tokens_per_minute=config['deepseek_tpm'])
+
+    for task in tasks:
+        issue = task['issue']
+
+        if task['result'] is None:
+            result = next(results)
+
+            if result and work_queue:
+                work_queue.mark(work_key(issue), 'prompted', result)
+        else:
+            result = task['result']
 
         log.info('Processing issue {id}: "{title}" with score {score}'.format(id=issue['id'], score=issue['score'],
                                                                          title=(issue['title'][:85] + '...') if len(issue['title']) > 80 else issue['title']))
 
-        prompt = ds.extra_prompt(issue, config, actions)
-        result = ds.ask(json.dumps(item_short), prompt)
-
         if result:
             comment_text = j.prepare_comment(result['message'], {'recipients': result['recipients'],
                                                                  'disable_mentions': config['disable_mentions']})
@@ -176,12 +513,140 @@ for i, root_issue in df_sorted.iterrows():
             log.info('Адресовано: ' + ', '.join(result['recipients']))
             log.info("\n\n")
 
-            # Выполнить работу менеджера: пушить выполнение задач в комментариях к ним
+            # Выполнить работу менеджера: пушить выполнение задач в комментариях к ним.
+            # Комментарий публикуется отдельным этапом, следующий ответ DeepSeek его не ждёт
             if config['mode'] == 'comment':
-                comment = j.add_comment(issue, comment_text)
+                comment_poster.submit(issue, comment_text)
+
+
+# Отметка опубликованного комментария в журнале этапов и в истории баллов
+def comment_posted(issue, comment):
+    if work_queue:
+        work_queue.mark(work_key(issue), 'commented', {'comment_id': comment.id})
+
+    if score_history:
+        score_history.mark_commented(issue['source'], issue['score'], getattr(comment, 'body', '') or '')
+
+# Журнал этапов обработки для продолжения прерванного запуска
+if config['work_queue']:
+    work_queue = WorkQueue(config['work_queue'], resume=config['resume'])
+
+    if work_queue.resumed:
+        log.info('Resuming run {run}: {prompted} prompted, {commented} commented'.format(
+            run=work_queue.run_id, prompted=work_queue.count('prompted'), commented=work_queue.count('commented')))
+else:
+    work_queue = None
+
+# Этап публикации комментариев. Записи в журнал комментариев дописываются, чтобы не потерять их при повторном запуске
+if config['mode'] == 'comment':
+    # Область метки не зависит от журнала этапов: новый запуск без --resume получает новый идентификатор
+    # в журнале, но не должен повторять комментарии, опубликованные в тот же день
+    comment_run_id = config['comment_run_id'] or time.strftime('%Y%m%d')
+
+    comment_poster = CommentPoster(j, comment_run_id, workers=config['comment_workers'],
+                                   queue_size=config['comment_queue'], log_path=config['comments_log'],
+                                   on_posted=comment_posted)
+else:
+    comment_poster = None
+
+# Запрашиваем у Jira только поля, используемые правилами всех выбранных запросов
+j.issue_fields = j.get_search_fields(custom_fields, [path for query in jira_queries
+                                                     for path in query_rules[query].get_paths()])
+log.debug('Search fields: ' + ', '.join(j.issue_fields))
+
+if config['verbose']:
+    j.measure_projection(next(iter(jira_queries.values())), j.issue_fields, max_results=config['jira_page_size'],
+                         expand='changelog')
+
+# Потоки для сбора данных по задачам
+enrich_pool = ThreadPoolExecutor(max_workers=max(1, config['enrich_workers']))
+
+issue_cache = IssueCache(config['issue_cache']) if config['incremental'] else None
+
+# Получаем задачи из Jira постранично и обрабатываем каждую страницу по мере получения.
+# Несколько запросов выполняются параллельно с общими кэшами задач
+log.info("Fetching issues: " + ', '.join(jira_queries))
+
+records = []
+merged = {}
+merge_lock = threading.Lock()
+comment_lock = threading.Lock()
+
+if len(jira_queries) > 1:
+    with ThreadPoolExecutor(max_workers=len(jira_queries)) as query_pool:
+        issues_count = sum(query_pool.map(run_query, jira_queries))
+else:
+    issues_count = sum(map(run_query, jira_queries))
+
+if not issues_count:
+    log.info("No Jira issues found!")
+
+# Часть сохраняет оценённые задачи. Последняя завершившаяся часть комментирует задачи всех частей
+# в общем порядке по баллу
+if config['shard'] is not None:
+    coordinator = ShardCoordinator(config['shard_db'], config['shard_run'], config['shards'])
+    coordinator.save_results(config['shard'], records)
+
+    if coordinator.finish(config['shard']):
+        records = coordinator.load_results()
+        log.info("All {shards} shards finished, {count} issues to process".format(shards=config['shards'], count=len(records)))
+    else:
+        log.info("Shard results saved, {finished} of {shards} shards finished".format(
+            finished=coordinator.finished_count(), shards=config['shards']))
+        records = []
+
+    coordinator.close()
+
+if records:
+    comment_issues(records)
+
+if comment_poster:
+    comment_poster.close()
+
+if score_history:
+    score_history.flush(score_history.run_id if config['shard'] is None else
+                        '{run}.shard{shard}'.format(run=score_history.run_id, shard=config['shard']))
+
+j.log_round_trips()
+metrics.log_stages()
+
+# Счётчики запуска
+metrics.set('issues', issues_count)
+metrics.set('jira_retries', scheduler.stats['retries'])
+
+for kind, count in j.round_trips.items():
+    metrics.set('jira_requests', count, kind=kind)
+
+for key, value in ds.cache_stats.items():
+    metrics.set('llm_cache_' + key, value)
+
+if config['metrics_file']:
+    metrics.export(config['metrics_file'], config['metrics_format'])
+
+if stop_profiler:
+    stop_profiler()
+
+if j.prompt_tokens:
+    log.info('Issue data sent to DeepSeek: ~{avg:.0f} tokens avg, ~{max} max'.format(
+        avg=sum(j.prompt_tokens) / len(j.prompt_tokens), max=max(j.prompt_tokens)))
+enrich_pool.shutdown()
+scheduler.shutdown()
+
+if issue_cache:
+    issue_cache.close()
+
+ds.log_cache_stats()
+
+if work_queue:
+    work_queue.finish()
+    work_queue.close()
+
+if response_cache:
+    response_cache.close()
 
-                # Запишем информацию про комментарий в файл
-                if comment and comments_log_file:
-                    comments_log_file.write(comment_text + "\n")
-                    comments_log_file.write(issue['url'] + "\n")
-                    comments_log_file.write("\n\n")
+# Задержки запросов к DeepSeek
+if ds.latencies:
+    for k in ['headers', 'first_token', 'total']:
+        values = [l[k] for l in ds.latencies if l[k] is not None]
+        if values:
+            log.info('DeepSeek {key}: avg {avg:.2f}s, max {max:.2f}s'.format(key=k, avg=sum(values) / len(values), max=max(values)))